@@ -5,16 +5,27 @@ from flask_cors import CORS
 # Import your Blueprints
 from routes.authroutes import auth_bp
 from routes.otp import otp_bp
-from routes.analysis_routes import ana_bp
+from routes.analysis_routes import ana_bp, get_job_queue
 from routes.case_routes import case_bp
 # from routes.report import report_bp
-from config.config import init_mail, mail,get_mongo_connection
+from config.config import init_mail, mail
+from config.db import mongo
+from config.json_provider import BSONJSONProvider
+from services.mailer import mailer
+from scripts.models import warmup_yolo
+from scripts.indexes import ensure_indexes
+import os
+import threading
 
 # Create Flask app
 app = Flask(__name__)
 
-# Initialize mail
+# Encode ObjectId/datetime in responses directly (extended JSON, as json_util.dumps)
+app.json = BSONJSONProvider(app)
+
+# Initialize mail and the background dispatcher that sends it
 init_mail(app)
+mailer.init_app(app)
 
 # Configure CORS properly
 CORS(app, 
@@ -39,8 +50,40 @@ app.register_blueprint(otp_bp, url_prefix='/api/otp')
 app.register_blueprint(ana_bp, url_prefix='/api/analysis')
 app.register_blueprint(case_bp, url_prefix='/api/cases')
 # app.register_blueprint(report_bp, url_prefix='/api/reports')
-m=get_mongo_connection()
-print("The value is ",m.db.name)
+
+def _ensure_indexes():
+    try:
+        ensure_indexes()
+    except Exception as e:
+        print(f"❌ Error ensuring MongoDB indexes: {e}")
+
+
+def start_services():
+    """Start the work the serving process does besides answering requests"""
+    # Optionally load YOLO and run a dummy frame before serving requests
+    if os.getenv("YOLO_WARMUP", "0") == "1":
+        warmup_yolo()
+
+    # Create the indexes used on hot paths (idempotent, disable with ENSURE_INDEXES=0).
+    # In the background, so an unreachable MongoDB doesn't hold up startup
+    if os.getenv("ENSURE_INDEXES", "1") == "1":
+        threading.Thread(target=_ensure_indexes, name="ensure-indexes", daemon=True).start()
+
+    # Start the analysis job workers now, so jobs left running by a restarted
+    # process are picked up again without waiting for a new submission
+    if os.getenv("ANALYSIS_JOB_AUTOSTART", "1") == "1":
+        try:
+            get_job_queue().start()
+        except Exception as e:
+            print(f"❌ Error starting analysis job workers: {e}")
+
+    print("The value is ",mongo.db.name)
+
+
+# Password pool processes (forkserver/spawn) re-run `python app.py` as __mp_main__
+# to unpickle their tasks; only the serving process may start the services
+if __name__ != "__mp_main__":
+    start_services()
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -1,10 +1,5 @@
 import os
-import pandas as pd
-from transformers import CLIPProcessor, CLIPModel
 from dotenv import load_dotenv
-import google.generativeai as genai
-from langchain_google_genai import ChatGoogleGenerativeAI
-from pymongo   import MongoClient
 from flask_mail import Mail
 
 # Load environment variables
@@ -12,11 +7,13 @@ load_dotenv()
 mail = Mail()
 
 def init_mail(app):
+    # Defaults to Gmail; override to point at a local SMTP server in development
     app.config.update(
-        MAIL_SERVER='smtp.gmail.com',
-        MAIL_PORT=587,
-        MAIL_USE_TLS=True,
-        MAIL_USE_SSL=False,
+        MAIL_SERVER=os.getenv("MAIL_SERVER", 'smtp.gmail.com'),
+        MAIL_PORT=int(os.getenv("MAIL_PORT", "587")),
+        MAIL_USE_TLS=os.getenv("MAIL_USE_TLS", "1") == "1",
+        MAIL_USE_SSL=os.getenv("MAIL_USE_SSL", "0") == "1",
+        MAIL_SUPPRESS_SEND=os.getenv("MAIL_SUPPRESS_SEND", "0") == "1",
         MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
         MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
         MAIL_DEFAULT_SENDER=os.getenv("MAIL_USERNAME")
@@ -24,26 +21,63 @@ def init_mail(app):
     mail.init_app(app)
 # API Keys and Configuration
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-genai.configure(api_key=GEMINI_API_KEY)
 MONGODB_URI = os.getenv("MONGODB_UR")  # MongoDB URI from .env file
 JWT_SECRET = os.getenv("JWT_SECRET")
-# Initialize Gemini LLM
-llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GEMINI_API_KEY)
+
+# Heavy client libraries (Gemini, LangChain, Cloudinary) are imported on first
+# use so that processes which never run inference start quickly
+_genai = None
+_llm = None
+_cloudinary_uploader = None
+
+def get_genai():
+    """Import and configure google.generativeai on first use"""
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+def get_llm():
+    """Initialize the LangChain Gemini LLM on first use"""
+    global _llm
+    if _llm is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        _llm = ChatGoogleGenerativeAI(model="gemini-2.0-flash", google_api_key=GEMINI_API_KEY)
+    return _llm
+
+def get_cloudinary_uploader():
+    """Import and configure Cloudinary on first use"""
+    global _cloudinary_uploader
+    if _cloudinary_uploader is None:
+        import cloudinary
+        import cloudinary.uploader
+        cloudinary.config(
+            cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+            api_key=os.getenv("CLOUDINARY_API_KEY"),
+            api_secret=os.getenv("CLOUDINARY_API_SECRET")
+        )
+        _cloudinary_uploader = cloudinary.uploader
+    return _cloudinary_uploader
+
+def __getattr__(name):
+    # Keep `from config.config import llm` working without building the client at import
+    if name == "llm":
+        return get_llm()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_mongo_connection():
-    try:
-        # Establish connection with MongoDB
-        client = MongoClient(MONGODB_URI)
-        return client
-    except Exception as e:
-        print(f"❌ Error: Failed to connect to MongoDB - {str(e)}")
-        return None
+    # Every caller shares the process-wide pooled client managed by config.db
+    from config.db import mongo
+    return mongo
 
 # Load Crime Dataset
 data_path = "C:\\Users\\Dell\\Desktop\\pro\\scenesolver\\backend\\crime_dataset.csv"
 def data_set():
     if os.path.exists(data_path):
+        import pandas as pd
         df = pd.read_csv(data_path)
         print("✅ Crime dataset loaded successfully")
         return df
@@ -51,11 +85,6 @@ def data_set():
         print(f"❌ Error: Dataset not found at {data_path}")
         df = None
 
-    # Load CLIP Model and Processor
-model_name = "openai/clip-vit-base-patch16"
-model = CLIPModel.from_pretrained(model_name)
-processor = CLIPProcessor.from_pretrained(model_name)
-print("✅ CLIP model loaded successfully")
 context=""  
 query=""
 # Forensic prompt template
@@ -0,0 +1,95 @@
+import os
+import threading
+from contextlib import contextmanager
+from pymongo import MongoClient
+from config.config import MONGODB_URI
+
+# One MongoClient (and so one connection pool) per process, shared by every model,
+# route and script. Pool size and timeouts are configurable from the environment.
+MONGO_CLIENT_OPTIONS = {
+    "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "50")),
+    "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+    "maxIdleTimeMS": int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000")),
+    "waitQueueTimeoutMS": int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000")),
+    "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+    "socketTimeoutMS": int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+    "serverSelectionTimeoutMS": int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+}
+
+# Multi-document transactions need a replica set or sharded cluster
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "0") == "1"
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def get_client():
+    """
+    Return this process's shared MongoClient, creating it on first use.
+    A client inherited from a parent process is never reused after fork.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # connect=False defers opening sockets until the first operation,
+            # so a client created before a pre-fork server forks stays unused
+            _client = MongoClient(MONGODB_URI, connect=False, **MONGO_CLIENT_OPTIONS)
+            _client_pid = pid
+        return _client
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    # The child must not touch the parent's sockets or a lock held during fork
+    global _lock, _client, _client_pid
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+@contextmanager
+def transaction():
+    """
+    Group writes across collections. Yields a session inside a transaction when
+    MONGO_TRANSACTIONS=1, otherwise None so the writes run without one.
+    """
+    if not MONGO_TRANSACTIONS:
+        yield None
+        return
+    with get_client().start_session() as session:
+        with session.start_transaction():
+            yield session
+
+
+class MongoConnection:
+    """
+    Module-level handle used instead of a MongoClient. Every attribute access
+    resolves to the current process's shared client, so `mongo.db.cases`
+    keeps working in modules that grab the handle at import time.
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __getitem__(self, name):
+        return get_client()[name]
+
+
+mongo = MongoConnection()
@@ -0,0 +1,66 @@
+"""
+Flask JSON provider that encodes MongoDB documents directly.
+
+ObjectId, datetime and the other BSON types are written in the same relaxed
+extended JSON shape as bson.json_util.dumps ({"$oid": ...}, {"$date": ...}),
+so routes can jsonify documents as they come from pymongo instead of
+round-tripping them through json_util.dumps and json.loads first.
+
+orjson is used when installed, otherwise the standard library json module.
+"""
+import json
+from datetime import datetime, timezone
+from bson import ObjectId, json_util
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _encode_datetime(value):
+    # Same output as json_util.default with RELAXED_JSON_OPTIONS
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    if value < EPOCH:
+        return json_util.default(value, json_util.RELAXED_JSON_OPTIONS)
+    offset = value.utcoffset()
+    tz_string = "Z" if not offset else value.strftime("%z")
+    millis = value.microsecond // 1000
+    fraction = ".%03d" % millis if millis else ""
+    return {"$date": f"{value.strftime('%Y-%m-%dT%H:%M:%S')}{fraction}{tz_string}"}
+
+
+def bson_default(value):
+    """Encode one value the JSON encoder does not handle natively"""
+    # The two types found in every document are handled without json_util
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, datetime):
+        return _encode_datetime(value)
+    try:
+        return json_util.default(value, json_util.RELAXED_JSON_OPTIONS)
+    except TypeError:
+        return DefaultJSONProvider.default(value)
+
+
+class BSONJSONProvider(DefaultJSONProvider):
+    default = staticmethod(bson_default)
+
+    def dumps(self, obj, **kwargs):
+        if orjson is None:
+            kwargs.setdefault("default", self.default)
+            kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+            kwargs.setdefault("sort_keys", self.sort_keys)
+            return json.dumps(obj, **kwargs)
+
+        # Datetimes go through default so they keep the {"$date": ...} shape
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if kwargs.get("sort_keys", self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
@@ -1,6 +1,9 @@
 import os
 import jwt
+import time
 import datetime
+import threading
+from collections import OrderedDict
 from functools import wraps
 from flask import request, jsonify
 from dotenv import load_dotenv
@@ -9,6 +12,15 @@ from dotenv import load_dotenv
 load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET", "default_secret")  # fallback for dev
 
+# Payloads of already verified tokens, so repeat requests skip signature checks.
+# Entries never outlive the token's exp claim; 0 disables the cache.
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+JWT_CACHE_TTL = float(os.getenv("JWT_CACHE_TTL", "300"))
+
+_token_lock = threading.Lock()
+_token_cache = OrderedDict()  # token -> (payload, expires_at)
+_token_stats = {"hits": 0, "misses": 0}
+
 # -------------------
 # Token Creation
 # -------------------
@@ -31,6 +43,52 @@ def create_token(email, role='investigator', user_id=None):
         algorithm='HS256'
     )
 
+# -------------------
+# Verified Token Cache
+# -------------------
+def _cached_payload(token):
+    with _token_lock:
+        entry = _token_cache.get(token)
+        if entry and entry[1] > time.time():
+            _token_cache.move_to_end(token)
+            _token_stats["hits"] += 1
+            return entry[0]
+        if entry:
+            del _token_cache[token]
+        _token_stats["misses"] += 1
+        return None
+
+
+def _remember_payload(token, payload):
+    if JWT_CACHE_SIZE <= 0:
+        return
+    expires_at = time.time() + JWT_CACHE_TTL
+    if 'exp' in payload:
+        expires_at = min(expires_at, float(payload['exp']))
+    with _token_lock:
+        _token_cache[token] = (payload, expires_at)
+        _token_cache.move_to_end(token)
+        while len(_token_cache) > JWT_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+
+
+def verify_token(token):
+    """
+    Return the payload of a valid token, from the cache when it was verified before.
+    Raises jwt.ExpiredSignatureError or jwt.InvalidTokenError like jwt.decode
+    """
+    payload = _cached_payload(token)
+    if payload is None:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        _remember_payload(token, payload)
+    # Handlers get their own copy to modify
+    return dict(payload)
+
+
+def token_cache_stats():
+    with _token_lock:
+        return dict(_token_stats, size=len(_token_cache))
+
 # -------------------
 # JWT Middleware
 # -------------------
@@ -53,7 +111,7 @@ def require_jwt(f):
             return jsonify({"error": "Unauthorized: No token provided"}), 401
 
         try:
-            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+            payload = verify_token(token)
             request.user = payload  # Set user info on the request
         except jwt.ExpiredSignatureError:
             return jsonify({"error": "Token expired"}), 401
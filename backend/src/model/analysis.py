@@ -1,13 +1,14 @@
 from flask import Flask
 from flask_pymongo import PyMongo
-from config.config import get_mongo_connection
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from config.config import MONGODB_URI
+from services import context_cache
 
-# Initialize Flask app and extensions
-# Replace with your MongoDB URI
-mongo = get_mongo_connection()
+# Shared pooled MongoDB connection
+from config.db import mongo, transaction
 
 # Analysis Model (MongoDB)
 class Analysis:
@@ -22,31 +23,74 @@ class Analysis:
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
 
-    def save(self):
-        try:
-            # 1. Check if an analysis already exists for this user, case, and image
-            existing_analysis = mongo.db.analyses.find_one({
-                'user_id': self.user_id,
-                'case_id': self.case_id,
-                'image_id': self.image_id
-            })
+    def key(self):
+        # Unique key of an analysis (enforced by the case_image_user_unique index)
+        return {
+            'user_id': self.user_id,
+            'case_id': self.case_id,
+            'image_id': self.image_id
+        }
 
-            if existing_analysis:
-                print("Analysis already exists for this image, case, and user with _id:", existing_analysis['_id'])
-                self._id = existing_analysis['_id']  # Set it on instance if needed
-                return self._id
+    def _insert_fields(self, new_id):
+        # Fields written on insert; the key fields come from the upsert filter
+        analysis_data = {k: v for k, v in self.__dict__.items() if k not in ('_id', 'user_id', 'case_id', 'image_id')}
+        analysis_data['_id'] = new_id
+        return analysis_data
+
+    def _image_fields(self):
+        # Fields copied onto the analysed image
+        return {
+            'updated_at': datetime.utcnow(),
+            'predicted_crime': self.predicted_crime,
+            'predicted_crime_type': self.predicted_crime_type,
+            'confidence_score': self.confidence_score,
+            'detected_objects': self.detected_objects
+        }
 
-            # 2. Create new analysis
-            self._id = ObjectId()
-            analysis_data = self.__dict__.copy()
-            analysis_data['_id'] = self._id
+    def _upsert(self, session=None):
+        # Insert the analysis unless one already exists for this key, in one round trip
+        new_id = ObjectId()
+        analysis_data = self._insert_fields(new_id)
+        saved = mongo.db.analyses.find_one_and_update(
+            self.key(),
+            {'$setOnInsert': analysis_data},
+            projection={'_id': 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+        return saved['_id'], saved['_id'] == new_id
+
+    def save(self, uow=None):
+        # Within a unit of work the analysis is written when the unit flushes,
+        # together with every other analysis of the request
+        if uow is not None:
+            uow.defer(Analysis._save_batch, self)
+            return None
+
+        try:
+            for attempt in (1, 2):
+                try:
+                    # The upsert and the linked image update share a transaction when enabled
+                    with transaction() as session:
+                        self._id, inserted = self._upsert(session)
 
-            mongo.db.analyses.insert_one(analysis_data)
+                        # Post-save updates
+                        if inserted:
+                            self.update_image_with_analysis(session)
+                            # self.update_user_with_analysis() if needed
+                    break
+                except DuplicateKeyError:
+                    # A concurrent worker inserted the same key first. The error aborted
+                    # the transaction, so the retry starts a new one and matches its document
+                    if attempt == 2:
+                        raise
 
-            # 3. Post-save updates
-            self.update_image_with_analysis()
-            # self.update_user_with_analysis() if needed
+            if not inserted:
+                print("Analysis already exists for this image, case, and user with _id:", self._id)
+                return self._id
 
+            context_cache.invalidate(self.case_id)
             print("New analysis inserted with _id:", self._id)
             return self._id
 
@@ -54,24 +98,56 @@ class Analysis:
             print(f"Error saving analysis: {error}")
             return None
 
-    def update_image_with_analysis(self):
+    def update_image_with_analysis(self, session=None):
         try:
             # Update the image with the analysis reference
             mongo.db.images.update_one(
                 {'_id': ObjectId(self.image_id)},
                 {
                     '$addToSet': {'analyses': self.__dict__['_id']},  # Add analysis to the image's analyses array
-                    '$set': {
-                        'updated_at': datetime.utcnow(),
-                        'predicted_crime': self.predicted_crime,
-                        'predicted_crime_type': self.predicted_crime_type,
-                        'confidence_score': self.confidence_score,
-                        'detected_objects': self.detected_objects
-                    }
-                }
+                    '$set': self._image_fields()
+                },
+                session=session
             )
         except Exception as error:
             print(f"Error updating image with analysis: {error}")
+            if session is not None:
+                raise
+
+    @staticmethod
+    def _save_batch(analyses, uow):
+        # 1. Analyses of images inserted by this unit of work cannot exist yet;
+        #    the others are looked up together in a single query
+        existing = set()
+        known = [a for a in analyses if uow.pending('images', _id=ObjectId(a.image_id)) is None]
+        if known:
+            found = mongo.db.analyses.find(
+                {'$or': [a.key() for a in known]},
+                {'user_id': 1, 'case_id': 1, 'image_id': 1},
+                session=uow.session
+            )
+            existing = {(d.get('user_id'), d.get('case_id'), d.get('image_id')) for d in found}
+
+        # 2. Queue the new analyses and fold their image updates into the same flush
+        for analysis in analyses:
+            key = (analysis.user_id, analysis.case_id, analysis.image_id)
+            if key in existing:
+                continue
+            existing.add(key)
+            analysis._id = ObjectId()
+            uow.upsert('analyses', analysis.key(), analysis._insert_fields(analysis._id))
+            # If another request stored this key first, the flush links the image
+            # to that analysis instead of the _id generated here
+            uow.update('images', ObjectId(analysis.image_id), analysis._image_fields(), {'analyses': analysis._id})
+            uow.after_flush(lambda analysis=analysis: Analysis._after_batch_flush(analysis, uow))
+
+    @staticmethod
+    def _after_batch_flush(analysis, uow):
+        # Adopt the ids of the documents actually stored
+        analysis._id = uow.resolve(analysis._id)
+        if isinstance(analysis.image_id, ObjectId):
+            analysis.image_id = uow.resolve(analysis.image_id)
+        context_cache.invalidate(analysis.case_id)
 
     def update(self, updated_data):
         try:
@@ -87,6 +163,7 @@ class Analysis:
                 {'_id': self.__dict__['_id']},
                 {'$set': {**updated_data, 'updated_at': self.updated_at}}
             )
+            context_cache.invalidate(self.case_id)
             return True
         except Exception as error:
             print(f"Error updating analysis: {error}")
@@ -96,6 +173,7 @@ class Analysis:
         try:
             # Delete the analysis from MongoDB
             mongo.db.analyses.delete_one({'_id': self.__dict__['_id']})
+            context_cache.invalidate(self.case_id)
             
             # Remove analysis reference from case
             mongo.db.cases.update_one(
@@ -214,6 +292,7 @@ class Analysis:
                     '$set': {'updated_at': datetime.utcnow()}
                 }
             )
+            context_cache.invalidate(case_id)
 
             # 3. Add object to image document too
             mongo.db.images.update_one(
@@ -0,0 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from config.db import mongo
+
+# Number of results kept in the in-process LRU in front of MongoDB
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "1024"))
+
+# Fields of a process_image result that describe the image itself and can be
+# reused for any case the same image is uploaded to
+CACHED_FIELDS = (
+    'predicted_crime',
+    'predicted_crime_type',
+    'confidence_score',
+    'image_url',
+    'cloudinary_public_id',
+    'metadata',
+)
+
+
+# Analysis result cache (MongoDB + in-process LRU), keyed by image sha256 and model version
+class AnalysisCache:
+    _lru = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def key(file_hash, model_version):
+        return f"{model_version}:{file_hash}"
+
+    @staticmethod
+    def get(file_hash, model_version):
+        key = AnalysisCache.key(file_hash, model_version)
+
+        # 1. In-process LRU
+        with AnalysisCache._lock:
+            if key in AnalysisCache._lru:
+                AnalysisCache._lru.move_to_end(key)
+                return dict(AnalysisCache._lru[key])
+
+        # 2. Shared MongoDB cache, populated by any worker
+        try:
+            cached = mongo.db.analysis_cache.find_one({'_id': key})
+        except Exception as error:
+            print(f"Error reading analysis cache: {error}")
+            return None
+        if not cached:
+            return None
+
+        result = cached.get('result', {})
+        AnalysisCache._remember(key, result)
+        return dict(result)
+
+    @staticmethod
+    def put(file_hash, model_version, result):
+        key = AnalysisCache.key(file_hash, model_version)
+        cached = {field: result[field] for field in CACHED_FIELDS if field in result}
+        AnalysisCache._remember(key, cached)
+        try:
+            mongo.db.analysis_cache.update_one(
+                {'_id': key},
+                {
+                    '$set': {
+                        'file_hash': file_hash,
+                        'model_version': model_version,
+                        'result': cached,
+                        'updated_at': datetime.utcnow()
+                    }
+                },
+                upsert=True
+            )
+        except Exception as error:
+            print(f"Error writing analysis cache: {error}")
+
+    @staticmethod
+    def _remember(key, result):
+        with AnalysisCache._lock:
+            AnalysisCache._lru[key] = result
+            AnalysisCache._lru.move_to_end(key)
+            while len(AnalysisCache._lru) > ANALYSIS_CACHE_SIZE:
+                AnalysisCache._lru.popitem(last=False)
@@ -1,10 +1,16 @@
 from flask import Flask
 from flask_pymongo import PyMongo
 from datetime import datetime
+import base64
 from bson import ObjectId
-from config.config import get_mongo_connection
+from pymongo import DESCENDING
+from config.db import mongo, transaction
+from services import context_cache
 
-mongo = get_mongo_connection()
+# Fields returned for each case in list views; the images array can grow large
+CASE_LIST_FIELDS = ['title', 'description', 'case_type', 'status', 'location',
+                    'date_of_incident', 'tags', 'date', 'last_updated']
+CASES_PAGE_MAX_LIMIT = 100
 
 # Case Model (MongoDB)
 class Case:
@@ -47,11 +53,71 @@ class Case:
             print(f"Error updating user with case: {error}")
 
     def delete_related_data(self):
-        # Delete related evidence, analyses, reports
-        mongo.db.evidence.delete_many({'case_id': str(self._id)})
-        mongo.db.analyses.delete_many({'case_id': str(self._id)})
-        mongo.db.reports.delete_many({'case_id': str(self._id)})
-        mongo.db.cases.delete_one({'_id': self._id})
+        # Delete the case with its evidence, analyses, reports and images
+        return Case.delete(self._id)
+
+    @staticmethod
+    def delete(case_id):
+        """Delete a case and everything that belongs to it"""
+        return Case.delete_many([case_id])
+
+    @staticmethod
+    def delete_many(case_ids):
+        """
+        Cascade delete of several cases in a constant number of round trips,
+        however many cases, images and analyses they have
+        """
+        try:
+            object_ids = [ObjectId(case_id) for case_id in case_ids]
+            # Child documents store the case id as a string
+            string_ids = [str(case_id) for case_id in object_ids]
+            if not object_ids:
+                return True
+
+            # 1. Collect the images and analyses of the cases
+            cases = list(mongo.db.cases.find({'_id': {'$in': object_ids}}, {'images': 1}))
+            image_ids = {image_id for case in cases for image_id in case.get('images', [])}
+            image_ids.update(mongo.db.images.distinct('_id', {'case_id': {'$in': string_ids}}))
+            analysis_ids = mongo.db.analyses.distinct('_id', {'case_id': {'$in': string_ids}})
+
+            # 2. Images are deduplicated by content, so keep those another case still uses
+            shared_ids = set(mongo.db.cases.distinct('images', {
+                '_id': {'$nin': object_ids},
+                'images': {'$in': list(image_ids)}
+            })) if image_ids else set()
+            orphan_ids = list(image_ids - shared_ids)
+
+            # 3. Delete children, drop back-references, then delete the cases
+            with transaction() as session:
+                mongo.db.evidence.delete_many({'case_id': {'$in': string_ids}}, session=session)
+                mongo.db.analyses.delete_many({'case_id': {'$in': string_ids}}, session=session)
+                mongo.db.reports.delete_many({'case_id': {'$in': string_ids}}, session=session)
+                if orphan_ids:
+                    mongo.db.images.delete_many({'_id': {'$in': orphan_ids}}, session=session)
+                if shared_ids and analysis_ids:
+                    mongo.db.images.update_many(
+                        {'_id': {'$in': list(shared_ids)}},
+                        {'$pull': {'analyses': {'$in': analysis_ids}}},
+                        session=session
+                    )
+                mongo.db.users.update_many(
+                    {'cases': {'$in': object_ids}},
+                    {'$pull': {
+                        'cases': {'$in': object_ids},
+                        'images': {'$in': orphan_ids},
+                        'analyses': {'$in': analysis_ids}
+                    }},
+                    session=session
+                )
+                mongo.db.cases.delete_many({'_id': {'$in': object_ids}}, session=session)
+
+            for case_id in string_ids:
+                context_cache.invalidate(case_id)
+            print(f"Deleted {len(string_ids)} case(s), {len(orphan_ids)} image(s), {len(analysis_ids)} analysis(es)")
+            return True
+        except Exception as error:
+            print(f"Error deleting cases: {error}")
+            return False
     
     @staticmethod
     def find_by_id(case_id):
@@ -73,7 +139,61 @@ class Case:
             print(f"Error finding cases by user ID: {error}")
             return []
     @staticmethod
-    def add_image_to_case(case_id, image_id):
+    def encode_cursor(case):
+        # Opaque cursor pointing after a case in (last_updated, _id) order
+        raw = f"{case['last_updated'].isoformat()}|{case['_id']}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            last_updated, case_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            return datetime.fromisoformat(last_updated), ObjectId(case_id)
+        except Exception:
+            raise ValueError("Invalid cursor")
+
+    @staticmethod
+    def find_page_by_user_id(user_id, limit=20, cursor=None, fields=None, with_total=False):
+        """
+        Find one page of a user's cases, most recently updated first.
+        Served by the user_last_updated_id index.
+
+        Returns (cases, next_cursor, total); next_cursor is None on the last page
+        and total is None unless with_total is set
+        """
+        limit = max(1, min(int(limit), CASES_PAGE_MAX_LIMIT))
+        query = {'user_id': user_id}
+
+        # 1. Continue after the last case of the previous page
+        if cursor:
+            last_updated, case_id = Case.decode_cursor(cursor)
+            query['$or'] = [
+                {'last_updated': {'$lt': last_updated}},
+                {'last_updated': last_updated, '_id': {'$lt': case_id}}
+            ]
+
+        # 2. Only the requested fields; last_updated is always needed for the cursor
+        projection = {field: 1 for field in (fields or CASE_LIST_FIELDS)}
+        projection['last_updated'] = 1
+
+        # 3. Fetch one extra case to know whether another page follows
+        cases = list(
+            mongo.db.cases.find(query, projection)
+            .sort([('last_updated', DESCENDING), ('_id', DESCENDING)])
+            .limit(limit + 1)
+        )
+        next_cursor = Case.encode_cursor(cases[limit - 1]) if len(cases) > limit else None
+        cases = cases[:limit]
+
+        total = mongo.db.cases.count_documents({'user_id': user_id}) if with_total else None
+        return cases, next_cursor, total
+
+    @staticmethod
+    def add_image_to_case(case_id, image_id, uow=None):
+        # Within a unit of work this is merged with the other updates of the case
+        if uow is not None:
+            uow.update('cases', ObjectId(case_id), {'last_updated': datetime.utcnow()}, {'images': image_id})
+            return True
         try:
             result = mongo.db.cases.update_one(
                 {'_id': ObjectId(case_id)},
@@ -1,15 +1,13 @@
 from flask import Flask
 import hashlib
 from flask_pymongo import PyMongo
-from config.config import get_mongo_connection
 from datetime import datetime
 from bson import ObjectId
 import requests
 from config.config import MONGODB_URI
 
-# Initialize Flask app and extensions
-# Replace with your MongoDB URI
-mongo = get_mongo_connection()
+# Shared pooled MongoDB connection
+from config.db import mongo
 
 # Image Model (MongoDB)
 class I:
@@ -22,19 +20,20 @@ class I:
         self.created_at = datetime.utcnow()
         self.updated_at = datetime.utcnow()
        
-    def save(self):
+    def save(self, file_hash=None, uow=None):
         # Save image to MongoDB
         try:
-            # Download image from Cloudinary URL
-            response = requests.get(self.file_path)
-            response.raise_for_status()
-            file_data = response.content
+            # The caller normally hashes the bytes it already has in memory;
+            # externally supplied URLs are downloaded only as a fallback
+            if file_hash is None:
+                response = requests.get(self.file_path)
+                response.raise_for_status()
+                file_hash = hashlib.sha256(response.content).hexdigest()
 
-            # Compute hash of image
-            file_hash = hashlib.sha256(file_data).hexdigest()
-
-            # Check if image with the same hash already exists
-            existing_image = mongo.db.images.find_one({'file_hash': file_hash})
+            # Check if image with the same hash already exists (or is about to)
+            existing_image = uow.pending('images', file_hash=file_hash) if uow is not None else None
+            if existing_image is None:
+                existing_image = mongo.db.images.find_one({'file_hash': file_hash})
             if existing_image:
                 print("Image already exists with _id:", existing_image['_id'])
                 return existing_image['_id']
@@ -44,15 +43,23 @@ class I:
             image_data['_id'] = ObjectId()
             image_data['file_hash'] = file_hash
 
-            mongo.db.images.insert_one(image_data)
-            self.update_case_with_image(image_data['_id'])
+            if uow is not None:
+                # A concurrent upload of the same file may win the unique file_hash index;
+                # the case and analysis links then go to its image instead
+                uow.insert('images', image_data, unique=('file_hash',))
+            else:
+                mongo.db.images.insert_one(image_data)
+            self.update_case_with_image(image_data['_id'], uow)
             print("New image inserted with _id:", image_data['_id'])
             return image_data['_id']
         except requests.RequestException as e:
             print(f"Error downloading image: {e}")
             return None
 
-    def update_case_with_image(self, image_id):
+    def update_case_with_image(self, image_id, uow=None):
+        if uow is not None:
+            uow.update('cases', ObjectId(self.case_id), {'last_updated': datetime.utcnow()}, {'images': image_id})
+            return
         try:
             # Update the case with the image reference
             mongo.db.cases.update_one(
@@ -4,7 +4,7 @@ from datetime import datetime
 from bson import ObjectId
 from config.config import MONGODB_URI
 
-mongo = PyMongo()
+from config.db import mongo
 
 # Report Model (MongoDB)
 class Report:
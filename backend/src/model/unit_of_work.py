@@ -0,0 +1,230 @@
+from collections import OrderedDict, defaultdict
+from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from config.db import mongo
+
+DUPLICATE_KEY = 11000
+
+
+def _replace_ids(value, id_map):
+    # Swap every ObjectId found in id_map for its replacement, in nested documents too
+    if isinstance(value, dict):
+        return {k: _replace_ids(v, id_map) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace_ids(v, id_map) for v in value]
+    if isinstance(value, ObjectId):
+        return id_map.get(value, value)
+    return value
+
+
+def _merge(update, set_fields, add_to_set):
+    update['$set'].update(set_fields)
+    for field, values in add_to_set.items():
+        merged = update['$addToSet'].setdefault(field, [])
+        for value in values:
+            if value not in merged:
+                merged.append(value)
+
+
+# Unit of work: collects the writes of one request and flushes them as a
+# single bulk_write per collection and kind of write
+class UnitOfWork:
+    def __init__(self, session=None):
+        self.session = session
+        self._inserts = defaultdict(OrderedDict)  # collection -> _id -> document
+        self._unique = {}  # (collection, _id) -> fields of the unique index the insert may race on
+        self._folded = defaultdict(dict)  # collection -> _id -> updates applied to a pending insert
+        self._updates = defaultdict(OrderedDict)  # collection -> _id -> {'$set': {}, '$addToSet': {}}
+        self._upserts = defaultdict(list)  # collection -> [(filter, document)]
+        self._deferred = OrderedDict()  # prepare function -> [items]
+        self._after_flush = []
+        self._resolved = {}  # queued _id -> _id of the document actually stored
+
+    def insert(self, collection, document, unique=None):
+        """
+        Queue an insert. unique names the fields of a unique index the insert may lose
+        to a concurrent writer; writes meant for the document then go to the winner
+        """
+        self._inserts[collection][document['_id']] = document
+        if unique:
+            self._unique[(collection, document['_id'])] = list(unique)
+
+    def pending(self, collection, **fields):
+        """Return a document queued for insertion that matches every field, if any"""
+        for document in self._inserts[collection].values():
+            if all(document.get(k) == v for k, v in fields.items()):
+                return document
+        return None
+
+    def update(self, collection, _id, set_fields=None, add_to_set=None):
+        """
+        Queue an update of one document. Updates of a document queued for insertion are
+        applied to it directly, and repeated updates of a document are merged into one
+        """
+        set_fields = set_fields or {}
+        add_to_set = {field: [value] for field, value in (add_to_set or {}).items()}
+
+        document = self._inserts[collection].get(_id)
+        if document is not None:
+            document.update(set_fields)
+            for field, values in add_to_set.items():
+                current = document.setdefault(field, [])
+                current.extend(v for v in values if v not in current)
+            # Kept to replay on the winning document if this insert loses a race
+            folded = self._folded[collection].setdefault(_id, {'$set': {}, '$addToSet': {}})
+            _merge(folded, set_fields, add_to_set)
+            return
+
+        update = self._updates[collection].setdefault(_id, {'$set': {}, '$addToSet': {}})
+        _merge(update, set_fields, add_to_set)
+
+    def upsert(self, collection, query, document):
+        """
+        Queue an insert of document unless one matching query already exists. Writes
+        queued with document['_id'] are redirected to the existing document's _id
+        """
+        self._upserts[collection].append((query, document))
+
+    def resolve(self, _id):
+        """_id of the document stored for a queued insert or upsert, once flushed"""
+        return self._resolved.get(_id, _id)
+
+    def defer(self, prepare, item):
+        """
+        Queue item for prepare(items, uow), called once with every item deferred to it
+        right before flushing. Lets models batch the reads they need to decide their writes
+        """
+        self._deferred.setdefault(prepare, []).append(item)
+
+    def after_flush(self, callback):
+        self._after_flush.append(callback)
+
+    def _bulk(self, collection, ops, allow_duplicates=False):
+        """
+        Run one unordered bulk_write. Returns its result details and the indexes of the
+        operations that hit a duplicate key, which only the caller can resolve
+        """
+        try:
+            result = mongo.db[collection].bulk_write(ops, ordered=False, session=self.session)
+            return result.bulk_api_result, set()
+        except BulkWriteError as error:
+            errors = error.details.get('writeErrors', [])
+            if not allow_duplicates or any(e.get('code') != DUPLICATE_KEY for e in errors):
+                raise
+            return error.details, {e['index'] for e in errors}
+
+    def _remap(self, id_map):
+        # Point the writes still queued at the documents that were actually stored
+        if not id_map:
+            return
+        self._resolved.update(id_map)
+        for collection, upserts in self._upserts.items():
+            self._upserts[collection] = [(_replace_ids(q, id_map), _replace_ids(d, id_map)) for q, d in upserts]
+        for collection, updates in self._updates.items():
+            remapped = OrderedDict()
+            for _id, update in updates.items():
+                target = remapped.setdefault(id_map.get(_id, _id), {'$set': {}, '$addToSet': {}})
+                _merge(target, _replace_ids(update['$set'], id_map), _replace_ids(update['$addToSet'], id_map))
+            self._updates[collection] = remapped
+
+    def _flush_inserts(self):
+        # A new document only references fresh ids, so inserts go first and the
+        # documents they replace are known before anything refers to them
+        id_map = {}
+        for collection, documents in self._inserts.items():
+            documents = list(documents.values())
+            if not documents:
+                continue
+            _, duplicates = self._bulk(collection, [InsertOne(d) for d in documents], allow_duplicates=True)
+            for index in duplicates:
+                document = documents[index]
+                fields = self._unique.get((collection, document['_id']))
+                if not fields:
+                    raise DuplicateKeyError(f"Duplicate insert into {collection}: {document['_id']}", DUPLICATE_KEY)
+                # A concurrent request inserted the same unique key first
+                winner = mongo.db[collection].find_one(
+                    {field: document.get(field) for field in fields}, {'_id': 1}, session=self.session
+                )
+                if winner is None:
+                    raise DuplicateKeyError(f"Duplicate insert into {collection} without a matching document", DUPLICATE_KEY)
+                id_map[document['_id']] = winner['_id']
+                # Updates folded into the lost insert still apply, to the winner
+                folded = self._folded[collection].get(document['_id'])
+                if folded:
+                    target = self._updates[collection].setdefault(winner['_id'], {'$set': {}, '$addToSet': {}})
+                    _merge(target, folded['$set'], folded['$addToSet'])
+        self._remap(id_map)
+
+    def _flush_upserts(self):
+        id_map = {}
+        for collection, upserts in self._upserts.items():
+            if not upserts:
+                continue
+            ops = [UpdateOne(query, {'$setOnInsert': document}, upsert=True) for query, document in upserts]
+            # Two writers upserting the same key at once: one inserts, the other
+            # fails with a duplicate key and is resolved like a match below
+            details, _ = self._bulk(collection, ops, allow_duplicates=True)
+            inserted = {u['index'] for u in details.get('upserted', [])}
+
+            # Documents that already existed are read back to learn their _id
+            matched = [(query, document) for index, (query, document) in enumerate(upserts) if index not in inserted]
+            if not matched:
+                continue
+            fields = list(matched[0][0])
+            found = mongo.db[collection].find(
+                {'$or': [query for query, _ in matched]},
+                {field: 1 for field in fields},
+                session=self.session
+            )
+            stored = {tuple(d.get(f) for f in fields): d['_id'] for d in found}
+            for query, document in matched:
+                stored_id = stored.get(tuple(query.get(f) for f in fields))
+                if stored_id is not None and stored_id != document.get('_id'):
+                    id_map[document['_id']] = stored_id
+        self._remap(id_map)
+
+    def _flush_updates(self):
+        for collection, updates in self._updates.items():
+            ops = []
+            for _id, update in updates.items():
+                body = {}
+                if update['$set']:
+                    body['$set'] = update['$set']
+                if update['$addToSet']:
+                    body['$addToSet'] = {field: {'$each': values} for field, values in update['$addToSet'].items()}
+                if body:
+                    ops.append(UpdateOne({'_id': _id}, body))
+            if ops:
+                self._bulk(collection, ops)
+
+    def flush(self):
+        """
+        Write everything collected so far: inserts, then upserts, then updates, one
+        bulk_write per collection each. Updates are redirected to the stored documents
+        when an insert or upsert raced with another request
+        """
+        while self._deferred:
+            prepare, items = self._deferred.popitem(last=False)
+            prepare(items, self)
+
+        self._flush_inserts()
+        self._flush_upserts()
+        self._flush_updates()
+
+        self._inserts.clear()
+        self._unique.clear()
+        self._folded.clear()
+        self._updates.clear()
+        self._upserts.clear()
+        callbacks, self._after_flush = self._after_flush, []
+        for callback in callbacks:
+            callback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        return False
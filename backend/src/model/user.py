@@ -4,10 +4,9 @@ from flask_bcrypt import Bcrypt
 from datetime import datetime
 from bson import ObjectId
 import bcrypt
-from config.config import get_mongo_connection
-from werkzeug.security import check_password_hash, generate_password_hash
-
-mongo = get_mongo_connection()
+from config.db import mongo
+from model.case import Case
+from services import password_pool
 
 # User Model (MongoDB)
 class User:
@@ -19,14 +18,14 @@ class User:
         self.created_at = created_at if created_at else datetime.utcnow()
         self.last_active = last_active if last_active else datetime.utcnow()
 
-    # Password hashing and comparison
+    # Password hashing and comparison (scrypt, run in the password process pool)
     @staticmethod
     def hash_password(password):
-        return generate_password_hash(password, method='scrypt')
+        return password_pool.hash_password(password)
     
     def check_password(p1, password):
        # return bcrypt.checkpw(self.password, password)
-        return check_password_hash(p1, password)
+        return password_pool.check_password(p1, password)
 
      
 
@@ -37,8 +36,8 @@ class User:
 
 
     def save(self):
-        # Save user to MongoDB
-        mongo.db.users.insert_one(self.__dict__)
+        # Save user to MongoDB and return the new user's _id
+        return mongo.db.users.insert_one(self.__dict__).inserted_id
 
     def get_cases(self, populate=False):
         if populate:
@@ -46,8 +45,9 @@ class User:
         return list(mongo.db.cases.find({'user_id': str(self._id)}).sort('last_updated', -1))
 
     def delete_related_data(self):
-        # Deleting related cases, evidence, analyses, reports
-        cases = mongo.db.cases.find({'user_id': str(self._id)})
-        for case in cases:
-            case.delete_related_data()  # Assuming similar methods on Case, Evidence, etc.
-        mongo.db.users.delete_one({'_id': self._id})
\ No newline at end of file
+        # Deleting related cases, evidence, analyses, reports and images in one batch
+        case_ids = mongo.db.cases.distinct('_id', {'user_id': str(self._id)})
+        if not Case.delete_many(case_ids):
+            return False
+        mongo.db.users.delete_one({'_id': self._id})
+        return True
\ No newline at end of file
@@ -1,8 +1,13 @@
 from flask import request, jsonify
-from flask import Blueprint, request, jsonify, Response, stream_with_context
-from scripts.analyze_image import process_image
-from scripts.q import process, yolo
+from flask import Blueprint, request, jsonify, Response, stream_with_context, url_for, current_app
+from scripts.analyze_image import process_images, CLIP_BATCH_SIZE
+from scripts.q import stream_process, yolo, annotated_options
+from scripts.image_loader import PixelBudget, ImageBudgetExceeded
+from services.jobs import JobQueue, create_store
+from io import BytesIO
+import threading
 import time
+import uuid
 # Assuming process_image and save_analyzed_image are already defined
 # Also assuming Flask route is properly decorated   
 ana_bp = Blueprint('analysis', __name__)
@@ -14,13 +19,14 @@ def analyze():
     try:
         if "images" not in request.files:
             return jsonify({"error": "No images provided"}), 400
-        files = request.files.getlist("images")
-        results = []
-        for file in files:
-            if file.filename:
-                result = process_image(file,request.form.get("case_id"),request.form.get("user_id"))
-                if result:
-                    results.append(result)
+        files = [file for file in request.files.getlist("images") if file.filename]
+        # Images are run through CLIP together, batch_size at a time
+        results = process_images(
+            files,
+            request.form.get("case_id"),
+            request.form.get("user_id"),
+            batch_size=request.form.get("batch_size", type=int)
+        )
         if not results:
             return jsonify({"error": "Failed to process any images"}), 500
 
@@ -46,6 +52,12 @@ def analyze():
 
 
 
+def sse_event(text):
+    # A newline inside a data field would end it early; SSE clients join the
+    # data lines of one event back together with newlines
+    return "".join(f"data: {line}\n" for line in text.split("\n")) + "\n"
+
+
 @ana_bp.route("/process_query", methods=["POST", "OPTIONS"])
 def process_query():
     # Handle OPTIONS request for CORS preflight
@@ -59,27 +71,26 @@ def process_query():
         if not query:
             return jsonify({"error": "Missing 'query' in form data"}), 400
         
-        # Import time module for streaming
-        import time
-        
-        # Call the process function from scripts.q
-        response = process(query,case_id)
-        
+        # Forward model chunks as they arrive; an LLM_CLIENT in the app config
+        # (e.g. a local fake) replaces Gemini
+        chunks = stream_process(query, case_id, client=current_app.config.get("LLM_CLIENT"))
+
+        # Wait for the first chunk here so model errors still return a 500
+        first = next(chunks, None)
+
         def generate():
-            if hasattr(response, 'text'):
-                text = response.text
-            else:
-                text = str(response)
-            
-            # Split the text into chunks for streaming
-            chunks = [text[i:i+100] for i in range(0, len(text), 100)]
-            for chunk in chunks:
-                yield f"data: {chunk}\n\n"
-                time.sleep(0.05)  # Small delay to simulate streaming
-        
+            if first is not None:
+                yield sse_event(first)
+            try:
+                for chunk in chunks:
+                    yield sse_event(chunk)
+            except Exception as e:
+                print(f"Error while streaming query response: {e}")
+
         return Response(
             stream_with_context(generate()),
-            mimetype='text/event-stream'
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
         )
     except Exception as e:
         print(f"Error processing query: {e}")
@@ -93,6 +104,38 @@ def process_query():
 
 
 
+def format_detection(filename, case_id, user_id, yolo_results):
+    # Format the results for frontend
+    return {
+        "filename": filename,
+        "case_id": case_id,
+        "user_id": user_id,
+        "detected_objects": yolo_results,
+        "timestamp": time.time()
+    }
+
+
+def format_failure(filename, case_id, user_id, error):
+    # Failed files keep their place in the results instead of disappearing
+    return {
+        "filename": filename,
+        "case_id": case_id,
+        "user_id": user_id,
+        "error": error,
+        "timestamp": time.time()
+    }
+
+
+def detect(file, filename, case_id, user_id, options, budget):
+    try:
+        yolo_results = yolo(file, user_id, case_id, options, budget)
+    except ImageBudgetExceeded as e:
+        return format_failure(filename, case_id, user_id, str(e))
+    if not yolo_results:
+        return format_failure(filename, case_id, user_id, "Failed to process image")
+    return format_detection(filename, case_id, user_id, yolo_results)
+
+
 @ana_bp.route("/analyze_images", methods=["POST", "OPTIONS"])
 def analyze_images():
     if request.method == 'OPTIONS':
@@ -106,34 +149,160 @@ def analyze_images():
         
         case_id = request.form.get("case_id")
         user_id = request.form.get("user_id")
+
+        # Optional form fields: output (data_url | url | multipart), format (jpeg | webp), quality,
+        # max_dim, annotate (0 skips drawing) and boxes (rows | columns)
+        try:
+            options = annotated_options(request.form)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # All images of the request share one decoded-pixel budget
+        budget = PixelBudget()
         
         for file in files:
             if file.filename:
                 # Pass the file directly to the yolo function
-                yolo_results = yolo(file,user_id,case_id)
-                
-                # Process the results and add to the response
-                if yolo_results:
-                    # Format the results for frontend
-                    formatted_result = {
-                        "filename": file.filename,
-                        "case_id": case_id,
-                        "user_id": user_id,
-                        "detected_objects": yolo_results,
-                        "timestamp": time.time()
-                    }
-                    results.append(formatted_result)
+                results.append(detect(file, file.filename, case_id, user_id, options, budget))
         
-        if not results:
-            return jsonify({"error": "Failed to process any images"}), 500
+        analyzed = sum(1 for result in results if "error" not in result)
+        if not analyzed:
+            return jsonify({"error": "Failed to process any images", "results": results}), 500
 
-        return jsonify({
+        payload = {
             "results": results,
-            "message": f"Successfully analyzed {len(results)} image(s)"
-        })
+            "message": f"Successfully analyzed {analyzed} of {len(results)} image(s)"
+        }
+        if options["output"] == "multipart":
+            return multipart_response(payload)
+        return jsonify(payload)
 
     except Exception as e:
         print(f"Error in analyze_images endpoint: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+
+
+
+def multipart_response(payload):
+    """
+    Send the JSON payload as the first part of a multipart/mixed response, followed by
+    one part per annotated image. Each annotated_image is replaced by "cid:<Content-ID>"
+    """
+    images = []
+    for index, result in enumerate(payload["results"]):
+        detection = result.get("detected_objects") or {}
+        if isinstance(detection.get("annotated_image"), bytes):
+            content_id = f"annotated-{index}"
+            images.append((content_id, detection["annotated_mime"], detection["annotated_image"]))
+            detection["annotated_image"] = f"cid:{content_id}"
+
+    boundary = uuid.uuid4().hex
+    body = current_app.json.dumps(payload).encode()
+
+    def generate():
+        yield f"--{boundary}\r\nContent-Type: application/json\r\n\r\n".encode() + body + b"\r\n"
+        # Image bytes go out as they are, without base64 or JSON escaping
+        for content_id, mime, data in images:
+            yield (f"--{boundary}\r\nContent-Type: {mime}\r\nContent-ID: <{content_id}>\r\n"
+                   f"Content-Length: {len(data)}\r\n\r\n").encode()
+            yield data
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode()
+
+    return Response(generate(), content_type=f"multipart/mixed; boundary={boundary}")
+
+
+# -------------------------------
+# Background analysis jobs
+# -------------------------------
+def _named_stream(filename, data):
+    stream = BytesIO(data)
+    stream.filename = filename
+    return stream
+
+
+def run_analyze_job(pending, case_id, user_id):
+    # CLIP jobs keep the batched forward pass and report progress per batch
+    for start in range(0, len(pending), CLIP_BATCH_SIZE):
+        batch = pending[start:start + CLIP_BATCH_SIZE]
+        files = [_named_stream(filename, data) for _, filename, data in batch]
+        for (index, _, _), result in zip(batch, process_images(files, case_id, user_id)):
+            yield index, result, result.get("error")
+
+
+def run_analyze_images_job(pending, case_id, user_id):
+    # Job results are stored in the job document, which must stay well under
+    # MongoDB's 16 MB limit: annotated images are uploaded and only linked
+    options = annotated_options()
+    options["output"] = "url"
+    budget = PixelBudget()
+    for index, filename, data in pending:
+        result = detect(_named_stream(filename, data), filename, case_id, user_id, options, budget)
+        yield index, (None if "error" in result else result), result.get("error")
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Create the analysis job queue; the app starts its workers (app.py)"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = JobQueue(create_store(), {
+                "analyze": run_analyze_job,
+                "analyze_images": run_analyze_images_job,
+            })
+        return _job_queue
+
+
+@ana_bp.route("/jobs", methods=["POST", "OPTIONS"])
+def submit_job():
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        if "images" not in request.files:
+            return jsonify({"error": "No images provided"}), 400
+
+        kind = request.form.get("kind", "analyze")
+        if kind not in ("analyze", "analyze_images"):
+            return jsonify({"error": f"Unknown job kind '{kind}'"}), 400
+
+        # Uploads are read now, the request's file streams are gone once we return
+        items = [(file.filename, file.read()) for file in request.files.getlist("images") if file.filename]
+        if not items:
+            return jsonify({"error": "No images provided"}), 400
+
+        job_id = get_job_queue().submit(kind, items, request.form.get("case_id"), request.form.get("user_id"))
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "total": len(items),
+            "status_url": url_for("analysis.job_status", job_id=job_id)
+        }), 202
+
+    except Exception as e:
+        print(f"Error in submit_job endpoint: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@ana_bp.route("/jobs/<job_id>", methods=["GET", "OPTIONS"])
+def job_status(job_id):
+    if request.method == 'OPTIONS':
+        return '', 204
+    try:
+        job = get_job_queue().status(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job), 200
+
+    except Exception as e:
+        print(f"Error in job_status endpoint: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
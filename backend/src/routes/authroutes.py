@@ -3,15 +3,14 @@ from werkzeug.security import generate_password_hash, check_password_hash
 import datetime
 import os
 from dotenv import load_dotenv
-from config.config import get_mongo_connection      # Assume you connect MongoDB in config/db.py
-from middleware.auth import create_token  # From previous auth.py
+from middleware.auth import create_token, require_jwt, token_cache_stats  # From previous auth.py
+from services import password_pool
 from model.user import User
 # Load .env
 load_dotenv()
 JWT_SECRET = os.getenv("JWT_SECRET", "default_secret")
 
 auth_bp = Blueprint('auth', __name__)
-mongo = get_mongo_connection()
 
 # -------------------------------
 # Register Route
@@ -52,6 +51,8 @@ def register():
             }
         }), 201
 
+    except password_pool.PasswordPoolBusy:
+        return jsonify({'message': 'Server busy, please try again'}), 503
     except Exception as e:
         print("Register Error:", e)
         return jsonify({'message': 'Server error'}), 500
@@ -93,6 +94,26 @@ def login():
             }
         })
 
+    except password_pool.PasswordPoolBusy:
+        return jsonify({'error': 'Server busy, please try again'}), 503
     except Exception as e:
         print("Login Error:", e)
         return jsonify({'error': 'Server error'}), 500
+
+# -------------------------------
+# Token Cache Stats Route
+# -------------------------------
+@auth_bp.route('/token-cache', methods=['GET'])
+@require_jwt
+def token_cache():
+    # Hit/miss counters of the verified-token cache in this worker
+    return jsonify(token_cache_stats()), 200
+
+# -------------------------------
+# Password Pool Stats Route
+# -------------------------------
+@auth_bp.route('/password-pool', methods=['GET'])
+@require_jwt
+def password_pool_stats():
+    # Queue depth and wait times of this worker's password hashing pool
+    return jsonify(password_pool.stats()), 200
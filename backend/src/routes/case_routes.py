@@ -1,6 +1,4 @@
 from flask import Blueprint, request, jsonify
-from bson.json_util import dumps
-import json
 import traceback
 from middleware.auth import require_jwt as token_required
 from model.case import Case  # Import your Case model
@@ -23,18 +21,44 @@ def get_cases():
         if not user_id:
             return jsonify({"error": "User ID is required"}), 400
         
+        # Paginated listing is opt-in; without limit or cursor every case is returned
+        if 'limit' in request.args or 'cursor' in request.args:
+            return get_cases_page(user_id)
+
         # Find cases by user_id
         cases = list(Case.find_by_user_id(user_id))
         
-        # Convert ObjectId to string for JSON serialization
-        cases_json = json.loads(dumps(cases))
-        
-        return jsonify(cases_json), 200
+        # ObjectId and datetime fields are encoded by the app's JSON provider
+        return jsonify(cases), 200
     except Exception as e:
         print(f"Error getting cases: {e}")
         traceback.print_exc()
         return jsonify({"error": "Server error"}), 500
 
+def get_cases_page(user_id):
+    # Query params: limit, cursor (next_cursor of the previous page),
+    # fields (comma-separated projection) and include_total=1
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+
+    fields = request.args.get('fields')
+    fields = [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+    with_total = request.args.get('include_total') in ('1', 'true')
+
+    try:
+        cases, next_cursor, total = Case.find_page_by_user_id(
+            user_id, limit, request.args.get('cursor'), fields, with_total
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page = {"cases": cases, "next_cursor": next_cursor}
+    if with_total:
+        page["total"] = total
+    return jsonify(page), 200
+
 @case_bp.route('/create', methods=['POST'])
 @token_required
 def create_case():
@@ -85,10 +109,8 @@ def get_case(case_id):
         if not case:
             return jsonify({"error": "Case not found"}), 404
         
-        # Convert ObjectId to string for JSON serialization
-        case_json = json.loads(dumps(case))
-        
-        return jsonify(case_json), 200
+        # ObjectId and datetime fields are encoded by the app's JSON provider
+        return jsonify(case), 200
     except Exception as e:
         print(f"Error getting case: {e}")
         traceback.print_exc()
@@ -1,43 +1,52 @@
 from flask import Blueprint, request, jsonify, current_app, make_response
 from flask_mail import Message
-from datetime import datetime, timedelta
-import random
+import threading
 import traceback
-import jwt
-from config.config import JWT_SECRET
 # from auth import token_required  # Your JWT middleware
 from middleware.auth import require_jwt as token_required  
 # from config.config import mail     # Flask-Mail instance
-from config.config import mail
+from services import otp_store
+from services.mailer import mailer, MailQueueFull
 otp_bp = Blueprint('otp', __name__)
 
-# In-memory OTP store (for demo)
-otp = {
-    'mailcode': None,
-    'email': None,
-    'expiresAt': None,
-}
-
 OTP_EXPIRATION_SECONDS = 45
 
-# Send OTP Email
+# Issued codes, one per user (memory or Mongo backend, see services/otp_store.py)
+_otp_store = None
+_otp_store_lock = threading.Lock()
+
+
+def get_otp_store():
+    """Create the OTP store on first use"""
+    global _otp_store
+    with _otp_store_lock:
+        if _otp_store is None:
+            _otp_store = otp_store.create_store()
+        return _otp_store
+
+
+def otp_key(payload):
+    # Codes are keyed by the email the token was issued to (unique per user).
+    # Not user_id: tokens from /register carried "None" there before User.save returned the ID
+    return payload.get('sub')
+
+# Queue OTP Email; the background mailer sends it, so the request never waits on SMTP
 def send_otp_email(email, code):
-    try:
-        msg = Message(
-            subject="Your OTP Code",
-            sender=current_app.config['MAIL_USERNAME'],
-            recipients=[email],
-            body=f"Your OTP code is: {code}\n\nThis code will expire in {OTP_EXPIRATION_SECONDS} seconds."
-        )
-        mail.send(msg)
-        print(f"OTP sent to {email}")
-    except Exception as e:
-        print("Error sending OTP:", e)
+    msg = Message(
+        subject="Your OTP Code",
+        sender=current_app.config['MAIL_USERNAME'],
+        recipients=[email],
+        body=f"Your OTP code is: {code}\n\nThis code will expire in {OTP_EXPIRATION_SECONDS} seconds."
+    )
+    message_id = mailer.submit(msg)
+    print(f"OTP queued for {email}")
+    return message_id
 
 # -------------------------------
 # Resend OTP Route
 # -------------------------------
 @otp_bp.route('/resend-otp', methods=['POST', 'OPTIONS'])
+@token_required
 def resend_otp():
     print("OTP route accessed with method:", request.method)
     
@@ -51,24 +60,8 @@ def resend_otp():
         return response
 
     try:
-        # Get token from x-auth-token header
-        token = request.headers.get('x-auth-token')
-        print("Token received:", token[:10] if token and len(token) > 10 else token)
-        
-        if not token:
-            print("No token provided")
-            return jsonify({"error": "Unauthorized: No token provided"}), 401
-        
-        try:
-            # Verify token
-            payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
-            print("Token decoded successfully:", payload)
-        except jwt.ExpiredSignatureError:
-            print("Token expired")
-            return jsonify({"error": "Token expired"}), 401
-        except jwt.InvalidTokenError as e:
-            print("Invalid token:", e)
-            return jsonify({"error": f"Invalid token: {str(e)}"}), 401
+        # Token already verified by the JWT middleware
+        payload = request.user
         
         # Get email from request body
         data = request.get_json()
@@ -87,14 +80,8 @@ def resend_otp():
         
         print("Using email:", email)
         
-        # Generate OTP
-        generated_otp = str(random.randint(100000, 999999))
-        otp['mailcode'] = generated_otp
-        otp['email'] = email
-        
-        # Set expiration time (current time + 45 seconds)
-        expiry_time = datetime.utcnow() + timedelta(seconds=OTP_EXPIRATION_SECONDS)
-        otp['expiresAt'] = expiry_time
+        # Generate OTP for this user, valid for 45 seconds
+        generated_otp, expiry_time = get_otp_store().issue(otp_key(payload), email, OTP_EXPIRATION_SECONDS)
         
         # Format the expiry time as ISO 8601 for JavaScript
         expiry_iso = expiry_time.isoformat() + 'Z'  # Add Z to indicate UTC
@@ -103,14 +90,19 @@ def resend_otp():
         print("Expiry time:", expiry_time)
         print("Expiry ISO:", expiry_iso)
         
-        send_otp_email(email, generated_otp)
-        print("OTP sent successfully")
+        try:
+            delivery_id = send_otp_email(email, generated_otp)
+        except MailQueueFull:
+            response = jsonify({'error': 'Too many pending emails, please try again shortly'})
+            response.headers.add('Access-Control-Allow-Origin', '*')
+            return response, 503
         
         # Create response with CORS headers
         response = jsonify({
             'status': 200,
             'message': 'OTP sent successfully. Valid for 45 seconds.',
-            'expiresAt': expiry_iso
+            'expiresAt': expiry_iso,
+            'deliveryId': delivery_id
         })
         
         # Add CORS headers manually
@@ -135,19 +127,32 @@ def verify_otp():
     data = request.get_json()
     user_otp = data.get('otp')
 
-    if not otp['mailcode']:
+    # Constant-time check against this user's code; valid and expired codes are consumed
+    result = get_otp_store().verify(otp_key(request.user), user_otp)
+
+    if result == otp_store.MISSING:
         return jsonify({'status': 500, 'message': 'OTP not generated. Please resend OTP.'}), 500
 
-    if datetime.utcnow() > otp['expiresAt']:
-        otp['mailcode'] = None
+    if result == otp_store.EXPIRED:
         return jsonify({'status': 401, 'message': 'OTP has expired. Please request a new one.'}), 401
 
-    if user_otp == otp['mailcode']:
-        otp['mailcode'] = None  # Invalidate OTP
+    if result == otp_store.VALID:
         return jsonify({'status': 200, 'message': 'Login successful'}), 200
     else:
         return jsonify({'status': 401, 'message': 'Invalid OTP'}), 401
 
+# -------------------------------
+# Delivery Status Route
+# -------------------------------
+@otp_bp.route('/delivery/<delivery_id>', methods=['GET'])
+@token_required
+def delivery_status(delivery_id):
+    # queued -> sending -> sent | failed, as tracked by this worker's mailer
+    status = mailer.status(delivery_id)
+    if not status:
+        return jsonify({'error': 'Delivery not found'}), 404
+    return jsonify(status), 200
+
 # -------------------------------
 # Test Route
 # -------------------------------
@@ -1,40 +1,24 @@
-from config.config import data_set
 import os
-import pandas as pd
-from io import BytesIO
-from PIL import Image
-import torch
-from scripts.q import process
-from transformers import CLIPProcessor, CLIPModel
+from scripts.q import compute_file_hash, upload_original
+from scripts.models import get_clip, CLIP_MODEL_NAME
+from scripts.image_loader import load_image, PixelBudget, CLIP_INPUT_SIZE
 from dotenv import load_dotenv
 from model.image import I
 from model.analysis import Analysis
 from model.case import Case
+from model.analysis_cache import AnalysisCache
+from model.unit_of_work import UnitOfWork
+from scripts.text_embeddings import model_version
+from bson import ObjectId
 import traceback
-import cloudinary
-import cloudinary.uploader
-import time
 load_dotenv()
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
-# Load CLIP Model and Processor
-model_name = "openai/clip-vit-base-patch16"
-model = CLIPModel.from_pretrained(model_name)
-processor = CLIPProcessor.from_pretrained(model_name)
+# Number of images sent through the CLIP image encoder per forward pass
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "16"))
+# Largest batch a request may ask for, which bounds the memory of one forward pass
+CLIP_MAX_BATCH_SIZE = int(os.getenv("CLIP_MAX_BATCH_SIZE", str(CLIP_BATCH_SIZE)))
 
 
 
-def upload_pil_image_to_cloudinary(pil_image):
-    buffer = BytesIO()
-    pil_image.save(buffer, format="JPEG")
-    buffer.seek(0)  # Important: reset stream to beginning
-
-    upload_result = cloudinary.uploader.upload(buffer)
-    return upload_result
-
 # # Load Crime Dataset
 # data_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "crime_dataset.csv")
 # if os.path.exists(data_path):
@@ -44,66 +28,177 @@ def upload_pil_image_to_cloudinary(pil_image):
 # else:
 #     print(f"Error: Dataset not found at {data_path}", file=sys.stderr)
 #     df = pd.DataFrame({"Crime Type": ["Property Crime"], "Crime Description": ["Burglary"]})
-df=data_set()
-def process_image(image_path, case_id=None,user_id=None):
+def _filename(file):
+    if isinstance(file, str):
+        return os.path.basename(file)
+    return getattr(file, "filename", None)
+
+
+def predict_crimes(images):
     """
-    Process an image using CLIP model to predict crime type
+    Run a batch of PIL images through CLIP in one forward pass and return
+    (predicted_crime, predicted_crime_type, confidence_score) for each image
     """
-    try:
-        # Load image
-        image = Image.open(image_path)
-        
-        # Preprocess image for CLIP
-        inputs = processor(images=image, return_tensors="pt", padding=True)
+    # torch is only needed once an image is actually analysed
+    import torch
+    from scripts.text_embeddings import get_text_embeddings
+
+    model, processor = get_clip()
+    inputs = processor(images=images, return_tensors="pt")
+    with torch.no_grad():
         image_features = model.get_image_features(**inputs)
+    image_features = torch.nn.functional.normalize(image_features, dim=-1)
+
+    # Crime description embeddings are computed once and cached on disk
+    text = get_text_embeddings(model, processor, CLIP_MODEL_NAME)
+
+    # Calculate similarity scores for the whole batch at once
+    similarity = image_features @ text.features.T
+    scores, best_match_idx = similarity.max(dim=1)
+
+    return [
+        (text.descriptions[idx], text.crime_types[idx], float(score))
+        for idx, score in zip(best_match_idx.tolist(), scores.tolist())
+    ]
 
-        # Get crime descriptions from dataset
-        crime_descriptions = df["Crime Description"].tolist()
-        text_inputs = processor(text=crime_descriptions, return_tensors="pt", padding=True)
-        text_features = model.get_text_features(**text_inputs)
-
-        # Calculate similarity scores
-        similarity = torch.nn.functional.cosine_similarity(image_features, text_features)
-        best_match_idx = torch.argmax(similarity).item()
-
-        # Get the best matching crime description and type
-        predicted_crime = crime_descriptions[best_match_idx]
-        predicted_crime_type = df[df["Crime Description"] == predicted_crime]["Crime Type"].values[0]
-        print(predicted_crime_type)
-        # Upload image to Cloudinary
-        upload_result = upload_pil_image_to_cloudinary(image)
-        
-        # Get image metadata
-        width, height = image.size
-        
-
-        #image uploading to the mongodb
-        image_one = I(case_id, user_id,upload_result['secure_url'])
-        image_id=image_one.save()
-        Case.add_image_to_case(case_id,image_id)
-        Analysis(case_id, user_id, image_id, predicted_crime, predicted_crime_type, float(similarity[best_match_idx])).save()
-        # Create result object
-        result = {
-            "predicted_crime": predicted_crime,
-            "predicted_crime_type": predicted_crime_type,
-            "confidence_score": float(similarity[best_match_idx]),
-            "image_url": upload_result['secure_url'],
-            "cloudinary_public_id": upload_result['public_id'],
-            "metadata": {
-                "image_size": [width, height],
-                "format": image.format,
-                "mode": image.mode
-            }
+
+def save_prediction(loaded, source, prediction, case_id=None, user_id=None, file_hash=None, uow=None):
+    """
+    Upload an analysed image and store its image, case and analysis records.
+    loaded is the downscaled LoadedImage, source the original upload.
+    With a unit of work the records are written when it flushes
+    """
+    predicted_crime, predicted_crime_type, confidence_score = prediction
+    print(predicted_crime_type)
+    # Upload the original bytes to Cloudinary
+    upload_result = upload_original(source)
+
+    # Get image metadata of the original
+    width, height = loaded.original_size
+
+    #image uploading to the mongodb
+    image_one = I(case_id, user_id,upload_result['secure_url'])
+    image_id=image_one.save(file_hash, uow)
+    Case.add_image_to_case(case_id,image_id,uow)
+    Analysis(case_id, user_id, image_id, predicted_crime, predicted_crime_type, confidence_score).save(uow)
+    # Create result object
+    result = {
+        "predicted_crime": predicted_crime,
+        "predicted_crime_type": predicted_crime_type,
+        "confidence_score": confidence_score,
+        "image_url": upload_result['secure_url'],
+        "cloudinary_public_id": upload_result['public_id'],
+        "metadata": {
+            "image_size": [width, height],
+            "format": loaded.format,
+            "mode": loaded.mode
         }
-        
-        # Add case_id if provided
-        if case_id:
-            result["case_id"] = case_id
-            
-        return result
+    }
+
+    # Add case_id if provided
+    if case_id:
+        result["case_id"] = case_id
+
+    return result
+
+
+def _error_result(filename, e):
+    print(f"Error processing image {filename}: {e}")
+    traceback.print_exc()
+    return {"filename": filename, "error": str(e), "traceback": traceback.format_exc()}
+
+
+def attach_cached_result(cached, image_id, case_id=None, user_id=None, uow=None):
+    """
+    Reuse a stored prediction for an image that was already analysed: only the
+    case reference and the analysis record for this case are written
+    """
+    Case.add_image_to_case(case_id, image_id, uow)
+    Analysis(case_id, user_id, image_id, cached['predicted_crime'], cached['predicted_crime_type'], cached['confidence_score']).save(uow)
+
+    result = dict(cached)
+    result["cached"] = True
+    if case_id:
+        result["case_id"] = case_id
+    return result
+
+
+def process_images(files, case_id=None, user_id=None, batch_size=None):
+    """
+    Process several images with CLIP, running the image encoder in batches of
+    batch_size (at most CLIP_MAX_BATCH_SIZE). Images already analysed by the same
+    model are answered from the result cache. Results are returned in upload order,
+    each tagged with its filename.
+    The image, case and analysis writes of all images are flushed together at the end
+    """
+    batch_size = min(max(1, batch_size or CLIP_BATCH_SIZE), CLIP_MAX_BATCH_SIZE)
+    try:
+        version = model_version(CLIP_MODEL_NAME)
     except Exception as e:
-        print(f"Error processing image: {e}")
-        traceback.print_exc()
-        return {"error": str(e), "traceback": traceback.format_exc()}
+        # Without the dataset no image can be predicted or looked up in the cache
+        return [_error_result(_filename(file), e) for file in files]
+    results = [None] * len(files)
+    pending = []  # (position, filename, file_hash, loaded image, file) still needing inference
+    uow = UnitOfWork()
+    # Caps the pixels decoded for the whole request, however large the photos are
+    budget = PixelBudget()
+
+    # 1. Hash every upload once and answer repeats from the result cache
+    for position, file in enumerate(files):
+        filename = _filename(file)
+        try:
+            file_hash = compute_file_hash(file)
+            cached = AnalysisCache.get(file_hash, version)
+            image_id = I.get_id_by_file_hash(file_hash) if cached else None
+            if image_id:
+                result = attach_cached_result(cached, ObjectId(image_id), case_id, user_id, uow)
+                result["filename"] = filename
+                results[position] = result
+            else:
+                # CLIP only needs the shortest side at its input size
+                loaded = load_image(file, min_side=CLIP_INPUT_SIZE, budget=budget)
+                pending.append((position, filename, file_hash, loaded, file))
+        except Exception as e:
+            results[position] = _error_result(filename, e)
+
+    # 2. One CLIP forward pass per batch of new images
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        try:
+            predictions = predict_crimes([loaded.image for _, _, _, loaded, _ in batch])
+        except Exception as e:
+            for position, filename, _, _, _ in batch:
+                results[position] = _error_result(filename, e)
+            continue
 
+        # 3. Match predictions back to their files and queue their records
+        for (position, filename, file_hash, loaded, file), prediction in zip(batch, predictions):
+            try:
+                result = save_prediction(loaded, file, prediction, case_id, user_id, file_hash, uow)
+                result["filename"] = filename
+                results[position] = result
+            except Exception as e:
+                results[position] = _error_result(filename, e)
 
+    # 4. One bulk write per collection for the whole request
+    try:
+        uow.flush()
+    except Exception as e:
+        return [
+            result if "error" in result else _error_result(result["filename"], e)
+            for result in results
+        ]
+
+    # Cache the new predictions only once their records are stored
+    for position, _, file_hash, _, _ in pending:
+        if "error" not in results[position]:
+            AnalysisCache.put(file_hash, version, results[position])
+
+    return results
+
+
+def process_image(image_path, case_id=None,user_id=None):
+    """
+    Process an image using CLIP model to predict crime type
+    """
+    return process_images([image_path], case_id, user_id, batch_size=1)[0]
@@ -0,0 +1,83 @@
+"""
+Microbenchmark of case list serialization. Compares the old response path
+
+    jsonify(json.loads(bson.json_util.dumps(cases)))
+
+with jsonify(cases) through BSONJSONProvider, on generated case documents
+shaped like the ones in the cases collection. Run from backend/src:
+
+    python -m scripts.bench_json --cases 300 --images 40
+"""
+import json
+import random
+import argparse
+import timeit
+from datetime import datetime, timedelta
+from bson import ObjectId, json_util
+from flask import Flask, jsonify
+from config.json_provider import BSONJSONProvider, orjson
+
+
+def make_cases(count, images_per_case):
+    """Generate case documents as returned by Case.find_by_user_id"""
+    user_id = str(ObjectId())
+    now = datetime.utcnow()
+    cases = []
+    for n in range(count):
+        created = now - timedelta(days=random.randint(0, 365), microseconds=random.randint(0, 999999))
+        cases.append({
+            "_id": ObjectId(),
+            "title": f"Case #{n}: burglary at warehouse",
+            "user_id": user_id,
+            "description": "Forced entry through the rear door, several items reported missing. " * 3,
+            "case_type": random.choice(["Theft", "Assault", "Vandalism", "Unspecified"]),
+            "status": random.choice(["New", "Open", "Closed"]),
+            "location": "221B Baker Street",
+            "date_of_incident": created,
+            "tags": ["night", "cctv", "forced-entry"],
+            "date": created,
+            "last_updated": created + timedelta(hours=random.randint(0, 48)),
+            "images": [ObjectId() for _ in range(images_per_case)],
+        })
+    return cases
+
+
+def bench(label, func, number):
+    seconds = min(timeit.repeat(func, number=number, repeat=5)) / number
+    print(f"{label:<32} {seconds * 1000:8.3f} ms")
+    return seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark case list JSON encoding")
+    parser.add_argument("--cases", type=int, default=300, help="cases per response")
+    parser.add_argument("--images", type=int, default=40, help="image ids per case")
+    parser.add_argument("--number", type=int, default=20, help="responses per timing run")
+    args = parser.parse_args()
+
+    cases = make_cases(args.cases, args.images)
+
+    legacy_app = Flask("legacy")
+    app = Flask("bson")
+    app.json = BSONJSONProvider(app)
+
+    def legacy():
+        with legacy_app.app_context():
+            return jsonify(json.loads(json_util.dumps(cases))).get_data()
+
+    def provider():
+        with app.app_context():
+            return jsonify(cases).get_data()
+
+    # Both paths must produce the same document
+    if json.loads(legacy()) != json.loads(provider()):
+        raise SystemExit("❌ BSONJSONProvider output differs from json_util.dumps")
+
+    print(f"{args.cases} cases x {args.images} images, JSON backend: {'orjson' if orjson else 'json'}")
+    old = bench("json_util.dumps + loads + jsonify", legacy, args.number)
+    new = bench("BSONJSONProvider", provider, args.number)
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
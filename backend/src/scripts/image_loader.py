@@ -0,0 +1,123 @@
+"""
+Shared image loading stage for CLIP and YOLO.
+
+Uploads are decoded straight to the size the model needs instead of full
+resolution: JPEGs use draft mode (the decoder skips DCT coefficients and emits
+1/2, 1/4 or 1/8 scale), EXIF orientation is applied, and the result is resized
+to the model's input size. The original bytes are still what gets uploaded and
+hashed, so full resolution is only kept in its compressed form.
+
+Every request gets a PixelBudget that caps how many pixels it may decode in total.
+"""
+import os
+import math
+import threading
+from io import BytesIO
+from typing import NamedTuple
+from PIL import Image, ImageOps
+
+# CLIP resizes the shortest side to 224 px; YOLO letterboxes the longest side to 640 px
+CLIP_INPUT_SIZE = int(os.getenv("CLIP_INPUT_SIZE", "224"))
+YOLO_INPUT_SIZE = int(os.getenv("YOLO_INPUT_SIZE", "640"))
+# Decoded pixels one request may allocate across all of its images. The default fits
+# 50 photos of 20 MP even when they can't be draft-decoded, as PNGs can't
+IMAGE_PIXEL_BUDGET = int(os.getenv("IMAGE_PIXEL_BUDGET", str(1_000_000_000)))
+
+EXIF_ORIENTATION = 0x0112
+
+
+class ImageBudgetExceeded(ValueError):
+    pass
+
+
+class PixelBudget:
+    """Pixels left to decode for one request, shared by all of its images"""
+
+    def __init__(self, limit=IMAGE_PIXEL_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self, pixels):
+        with self._lock:
+            if self.limit and self.used + pixels > self.limit:
+                raise ImageBudgetExceeded(
+                    f"Image needs {pixels} pixels but only {self.limit - self.used} of the request's budget are left"
+                )
+            self.used += pixels
+
+
+class LoadedImage(NamedTuple):
+    image: Image.Image  # RGB, EXIF orientation applied, downscaled
+    scale: float  # loaded size / original size
+    original_size: tuple  # (width, height) after EXIF orientation
+    format: str
+    mode: str  # mode of the original file
+
+
+def read_bytes(source):
+    """Return the bytes of a path, bytes or file-like upload, rewinding streams for the next reader"""
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    if isinstance(source, (bytes, bytearray)):
+        return bytes(source)
+    source.seek(0)
+    data = source.read()
+    source.seek(0)
+    return data
+
+
+def load_image(source, max_side=None, min_side=None, budget=None):
+    """
+    Decode an image no larger than the model needs
+
+    Args:
+        source: Path, bytes or file-like object
+        max_side: Longest side of the result, e.g. YOLO_INPUT_SIZE (None keeps it)
+        min_side: Shortest side of the result, e.g. CLIP_INPUT_SIZE (None keeps it)
+        budget: The request's PixelBudget, charged with the decoded size
+
+    Returns:
+        LoadedImage
+
+    Raises:
+        ImageBudgetExceeded: If decoding would exceed the request's pixel budget
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    elif not isinstance(source, str):
+        source.seek(0)
+    image = Image.open(source)
+    image_format, original_mode = image.format, image.mode
+
+    # 1. Scale down until every requested side fits; the sides don't depend on EXIF rotation
+    width, height = image.size
+    ratio = 1.0
+    if max_side:
+        ratio = min(ratio, max_side / max(width, height))
+    if min_side:
+        ratio = min(ratio, min_side / min(width, height))
+
+    # 2. JPEG draft mode decodes at the smallest 1/2^n scale still covering the target
+    if ratio < 1.0:
+        image.draft("RGB", (max(1, math.ceil(width * ratio)), max(1, math.ceil(height * ratio))))
+
+    # 3. Charge the pixels about to be decoded before decoding them
+    if budget is not None:
+        budget.take(image.size[0] * image.size[1])
+
+    # Orientations 5-8 rotate by 90 degrees, swapping width and height
+    if image.getexif().get(EXIF_ORIENTATION, 1) in (5, 6, 7, 8):
+        width, height = height, width
+    image = ImageOps.exif_transpose(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # 4. Final resize to the exact target size
+    if ratio < 1.0:
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        if size != image.size:
+            image = image.resize(size, Image.BICUBIC)
+
+    return LoadedImage(image, image.size[0] / width, (width, height), image_format, original_mode)
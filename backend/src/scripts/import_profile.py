@@ -0,0 +1,103 @@
+"""
+Import-time profile of the Flask app.
+
+Runs `python -X importtime -c "import app"` in a fresh interpreter and reports
+the slowest imports, plus any heavy inference library that got pulled in at
+startup. Run from backend/src:
+
+    python -m scripts.import_profile --top 25 --budget-ms 3000
+"""
+import os
+import re
+import subprocess
+import sys
+import argparse
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Libraries that must only be imported on first use, never while the app starts
+HEAVY_MODULES = [
+    "torch",
+    "transformers",
+    "ultralytics",
+    "cv2",
+    "pandas",
+    "langchain_google_genai",
+    "google.generativeai",
+    "cloudinary",
+]
+
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def profile_imports(target="app"):
+    """Return [(module, self_us, cumulative_us, depth)] for a fresh `import target`"""
+    # Only imports are measured: the app's startup services would add network I/O
+    env = dict(os.environ, ENSURE_INDEXES="0", ANALYSIS_JOB_AUTOSTART="0", YOLO_WARMUP="0")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=SRC_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        print(proc.stderr.splitlines()[-1] if proc.stderr else "import failed", file=sys.stderr)
+
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            entries.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return entries, proc.returncode
+
+
+def report(entries, top=20):
+    # Top-level entries are the ones imported directly by the target, their
+    # cumulative times add up to the whole startup cost
+    total_us = sum(cumulative for _, _, cumulative, depth in entries if depth == 0)
+    loaded = {module for module, _, _, _ in entries}
+    heavy = [name for name in HEAVY_MODULES if name in loaded]
+
+    print(f"Total import time: {total_us / 1000:.1f} ms ({len(entries)} modules)")
+    print(f"\nTop {top} imports by cumulative time:")
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for module, self_us, cumulative_us, _ in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {module}")
+
+    if heavy:
+        print("\nHeavy modules imported at startup: " + ", ".join(heavy))
+    else:
+        print("\nNo heavy inference modules imported at startup")
+    return total_us, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import-time cost of the backend")
+    parser.add_argument("--target", default="app", help="module to import (default: app)")
+    parser.add_argument("--top", type=int, default=20, help="number of slowest imports to list")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="fail if total import time exceeds this many milliseconds")
+    parser.add_argument("--allow-heavy", action="store_true",
+                        help="do not fail when heavy inference modules are imported")
+    args = parser.parse_args()
+
+    entries, returncode = profile_imports(args.target)
+    if not entries:
+        return returncode or 1
+
+    total_us, heavy = report(entries, args.top)
+
+    failed = False
+    if args.budget_ms is not None and total_us / 1000 > args.budget_ms:
+        print(f"\n❌ Import time {total_us / 1000:.1f} ms exceeds budget of {args.budget_ms:.0f} ms")
+        failed = True
+    if heavy and not args.allow_heavy:
+        print("❌ Heavy modules must be imported lazily")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Index management for the MongoDB collections used on hot paths.
+
+ensure_indexes() is idempotent and runs at app startup (disable with
+ENSURE_INDEXES=0). It can also be run by hand from backend/src:
+
+    python -m scripts.indexes            # create indexes, then check query plans
+    python -m scripts.indexes --check    # only report queries without an index
+"""
+import sys
+import argparse
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from config.db import mongo
+
+INDEXES = {
+    # Analysis.save upserts on the unique (user_id, case_id, image_id) key;
+    # leading with case_id lets get_context's case_id lookups use the same index.
+    # The key order differs from the superseded case_user_image index so both can
+    # exist while this one is built
+    "analyses": [
+        IndexModel([("case_id", ASCENDING), ("image_id", ASCENDING), ("user_id", ASCENDING)],
+                   name="case_image_user_unique", unique=True),
+    ],
+    # I.save and I.get_id_by_file_hash deduplicate images by content hash
+    "images": [
+        IndexModel([("file_hash", ASCENDING)], name="file_hash_unique", unique=True),
+    ],
+    # Case.find_by_user_id and User.get_cases list a user's cases, newest first;
+    # _id breaks ties for Case.find_page_by_user_id's (last_updated, _id) cursor
+    "cases": [
+        IndexModel([("user_id", ASCENDING), ("last_updated", DESCENDING), ("_id", DESCENDING)],
+                   name="user_last_updated_id"),
+    ],
+    # User.find_one looks users up by email at login and registration
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+    ],
+    # Job workers claim the oldest queued job, or a running one whose lease expired
+    "analysis_jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_created_at"),
+        IndexModel([("status", ASCENDING), ("heartbeat_at", ASCENDING)], name="status_heartbeat_at"),
+    ],
+    # MongoOTPStore codes are removed by the TTL monitor once they expire
+    "otps": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+# Indexes replaced by the ones above, dropped once their replacements are built
+SUPERSEDED_INDEXES = {
+    "analyses": ["case_user_image", "case_user_image_unique"],
+    "cases": ["user_last_updated"],
+}
+
+# (collection, caller, filter, sort) for every hot-path query the indexes must serve
+HOT_QUERIES = [
+    ("analyses", "Analysis.save / add_detected_object",
+     {"user_id": "", "case_id": "", "image_id": None}, None),
+    ("analyses", "scripts.q.get_context", {"case_id": ""}, None),
+    ("images", "I.save / I.get_id_by_file_hash", {"file_hash": ""}, None),
+    ("cases", "Case.find_by_user_id", {"user_id": ""}, [("last_updated", DESCENDING)]),
+    ("cases", "Case.find_page_by_user_id", {"user_id": ""}, [("last_updated", DESCENDING), ("_id", DESCENDING)]),
+    ("users", "User.find_one", {"email": ""}, None),
+    ("analysis_jobs", "MongoJobStore.claim", {"status": "queued"}, [("created_at", ASCENDING)]),
+]
+
+
+def _db(db):
+    return db if db is not None else mongo.db
+
+
+def ensure_indexes(db=None):
+    """
+    Create every index in INDEXES that does not exist yet, then drop the ones they
+    supersede. A superseded index stays in place when its replacement fails to build
+
+    Returns:
+        List of error messages for indexes that could not be created
+    """
+    db = _db(db)
+    errors = []
+    for collection, models in INDEXES.items():
+        try:
+            # 1. Build the new indexes while the old ones keep serving queries
+            db[collection].create_indexes(models)
+            # 2. Only then drop what they replace
+            existing = db[collection].index_information()
+            for name in SUPERSEDED_INDEXES.get(collection, []):
+                if name in existing:
+                    db[collection].drop_index(name)
+        except OperationFailure as e:
+            # e.g. an index with the same name but other options, or duplicate
+            # values preventing a unique index
+            errors.append(f"{collection}: {e}")
+            print(f"❌ Error creating indexes on {collection}: {e}")
+    if not errors:
+        print("✅ MongoDB indexes are up to date")
+    return errors
+
+
+def _stages(plan):
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + ([plan["inputStage"]] if "inputStage" in plan else []):
+        yield from _stages(child)
+
+
+def missing_indexes(db=None):
+    """
+    Explain every hot-path query and return those whose winning plan scans a collection
+
+    Returns:
+        List of (collection, caller, filter) without a usable index
+    """
+    db = _db(db)
+    missing = []
+    for collection, caller, query, sort in HOT_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        stages = set(_stages(plan))
+        if "COLLSCAN" in stages or "SORT" in stages:
+            missing.append((collection, caller, query))
+    return missing
+
+
+def report_missing(db=None):
+    missing = missing_indexes(db)
+    for collection, caller, query in missing:
+        print(f"❌ {caller}: {collection}.find({query}) is not served by an index")
+    if not missing:
+        print("✅ All hot-path queries are served by an index")
+    return missing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create and check MongoDB indexes")
+    parser.add_argument("--check", action="store_true", help="only report queries without an index")
+    args = parser.parse_args()
+
+    errors = [] if args.check else ensure_indexes()
+    missing = report_missing()
+    return 1 if errors or missing else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import os
+import threading
+from contextlib import contextmanager
+
+# Process-wide registry of inference models.
+# Each model is loaded once on first use and shared by every request thread.
+
+YOLO_WEIGHTS = os.getenv("YOLO_WEIGHTS", "yolov8n.pt")
+CLIP_MODEL_NAME = os.getenv("CLIP_MODEL_NAME", "openai/clip-vit-base-patch16")
+
+_registry_lock = threading.Lock()
+_loaders = {}
+_models = {}
+_inference_locks = {}
+
+
+def register(name, loader):
+    """Register a zero-argument loader for a model name"""
+    with _registry_lock:
+        _loaders[name] = loader
+        _inference_locks.setdefault(name, threading.Lock())
+
+
+def get(name):
+    """Return the shared instance of a model, loading it on first use"""
+    model = _models.get(name)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        model = _models.get(name)
+        if model is None:
+            if name not in _loaders:
+                raise KeyError(f"No model registered under '{name}'")
+            print(f"Loading model '{name}'...")
+            model = _loaders[name]()
+            _models[name] = model
+            print(f"✅ Model '{name}' loaded")
+        return model
+
+
+@contextmanager
+def use(name, timeout=None):
+    """
+    Hand out a model for inference. Calls are serialised per model because
+    the underlying predictors keep per-call state and are not thread-safe.
+    With a timeout, raises TimeoutError if the model stays busy that long
+    """
+    model = get(name)
+    lock = _inference_locks[name]
+    if not lock.acquire(timeout=-1 if timeout is None else max(0, timeout)):
+        raise TimeoutError(f"Model '{name}' still busy after {timeout:.0f}s")
+    try:
+        yield model
+    finally:
+        lock.release()
+
+
+def _load_yolo():
+    from ultralytics import YOLO
+    return YOLO(YOLO_WEIGHTS)
+
+
+register("yolo", _load_yolo)
+
+
+def get_yolo():
+    return get("yolo")
+
+
+def warmup_yolo(size=640):
+    """Load YOLO and run a dummy frame through it so the first request pays inference time only"""
+    try:
+        import numpy as np
+        with use("yolo") as model:
+            model(np.zeros((size, size, 3), dtype=np.uint8), verbose=False)
+        print("✅ YOLO warm-up complete")
+    except Exception as e:
+        print(f"Error warming up YOLO: {e}")
+
+
+def _load_clip():
+    # transformers is only imported by the first caller that actually needs CLIP
+    from transformers import CLIPProcessor, CLIPModel
+    model = CLIPModel.from_pretrained(CLIP_MODEL_NAME)
+    model.eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_NAME)
+    return model, processor
+
+
+register("clip", _load_clip)
+
+
+def get_clip():
+    """Return the shared (model, processor) pair for CLIP"""
+    return get("clip")
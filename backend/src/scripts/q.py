@@ -6,66 +6,120 @@ import io
 from io import BytesIO
 import os
 import base64
-import cloudinary
-import cloudinary.uploader
-import numpy as np
 from PIL import Image
 from dotenv import load_dotenv
-import google.generativeai as genai
 from model.image import I
 from model.analysis import Analysis
-from config.config import FORENSIC_PROMPT_TEMPLATE,get_mongo_connection
+from config.config import FORENSIC_PROMPT_TEMPLATE,get_genai,get_cloudinary_uploader
+from config.db import mongo
 from flask_cors import cross_origin
-import cv2
-from ultralytics import YOLO
-mongo = get_mongo_connection()
-db = mongo.db
+from scripts.models import use as use_model
+from scripts.image_loader import load_image, read_bytes, PixelBudget, ImageBudgetExceeded, YOLO_INPUT_SIZE
+from services import context_cache
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 load_dotenv()
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
-def upload_pil(pil_image):
-    buffer = BytesIO()
-    image = Image.open(pil_image)
-    image.save(buffer, format="JPEG")
-    buffer.seek(0)  # Important: reset stream to beginning
-
-    upload_result = cloudinary.uploader.upload(buffer)
-    return upload_result
-def generate():
-    if hasattr(response, 'text'):
-        text = response.text
-    else:
-        text = str(response)
-        chunks = [text[i:i+100] for i in range(0, len(text), 100)]
-        for chunk in chunks:
-            yield f"data: {chunk}\n\n"
-            time.sleep(0.10)  # Small delay to simulate streaming
 
+# Bounded pool running the independent stages of yolo() (Cloudinary upload,
+# YOLO inference, Gemini labeling) concurrently, with a timeout per stage
+YOLO_STAGE_WORKERS = int(os.getenv("YOLO_STAGE_WORKERS", "6"))
+YOLO_STAGE_TIMEOUTS = {
+    "upload": float(os.getenv("YOLO_UPLOAD_TIMEOUT", "30")),
+    "inference": float(os.getenv("YOLO_INFERENCE_TIMEOUT", "60")),
+    "labels": float(os.getenv("YOLO_LABELS_TIMEOUT", "30")),
+}
+stage_pool = ThreadPoolExecutor(max_workers=YOLO_STAGE_WORKERS, thread_name_prefix="yolo-stage")
+
+# What yolo() returns. The annotated image comes back as "data_url" (base64 inside
+# the JSON), "url" (uploaded to Cloudinary, JSON holds the link) or "multipart" (raw
+# bytes for the route to send as a separate part). Each setting can be overridden per request.
+ANNOTATED_OUTPUT_MODES = ("data_url", "url", "multipart")
+ANNOTATED_FORMATS = {"jpeg": "image/jpeg", "webp": "image/webp"}
+ANNOTATED_DEFAULTS = {
+    "output": os.getenv("ANNOTATED_OUTPUT", "data_url"),
+    "format": os.getenv("ANNOTATED_FORMAT", "jpeg"),
+    "quality": int(os.getenv("ANNOTATED_QUALITY", "85")),
+    # Longest side of the annotated image in pixels, 0 keeps the original size
+    "max_dim": int(os.getenv("ANNOTATED_MAX_DIM", "1600")),
+    # Draw the annotated image at all; detections alone skip rendering and encoding
+    "annotate": os.getenv("YOLO_ANNOTATE", "1") == "1",
+    # "rows" (one dict per box) or "columns" (one list per field)
+    "boxes": os.getenv("YOLO_BOX_FORMAT", "rows"),
+}
+
+
+def annotated_options(overrides=None):
+    """
+    Merge per-request settings (e.g. request.form) over ANNOTATED_DEFAULTS
+
+    Raises:
+        ValueError: If a setting is not supported
+    """
+    overrides = overrides or {}
+    options = dict(ANNOTATED_DEFAULTS)
+    for key in ("output", "format", "boxes"):
+        if overrides.get(key):
+            options[key] = overrides[key].lower()
+    if overrides.get("annotate"):
+        options["annotate"] = overrides["annotate"].lower() in ("1", "true")
+    for key in ("quality", "max_dim"):
+        if overrides.get(key):
+            options[key] = int(overrides[key])
+    if options["output"] not in ANNOTATED_OUTPUT_MODES:
+        raise ValueError(f"output must be one of {', '.join(ANNOTATED_OUTPUT_MODES)}")
+    if options["format"] not in ANNOTATED_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(ANNOTATED_FORMATS)}")
+    if options["boxes"] not in ("rows", "columns"):
+        raise ValueError("boxes must be rows or columns")
+    options["quality"] = max(1, min(options["quality"], 100))
+    return options
+
+
+def encode_annotated(img_array, options):
+    """Encode the annotated frame, capped to max_dim; returns (bytes, mime type)"""
+    image = Image.fromarray(img_array)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    if options["max_dim"] and max(image.size) > options["max_dim"]:
+        image.thumbnail((options["max_dim"], options["max_dim"]), Image.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format=options["format"].upper(), quality=options["quality"])
+    return buffered.getvalue(), ANNOTATED_FORMATS[options["format"]]
+
+def upload_original(source, timeout=None):
+    # The uploaded bytes are stored as they are, without decoding or re-encoding them
+    options = {"timeout": timeout} if timeout else {}
+    upload_result = get_cloudinary_uploader().upload(BytesIO(read_bytes(source)), **options)
+    return upload_result
 def get_context(case_id):
-    # Simple one-liner to get all analyses with predicted crime and type for a case
-    print("The case id is ",case_id)    
-    analyses = list(db.analyses.find(
+    # Chat sessions ask many questions about the same case; reuse its context
+    # until one of its analyses changes
+    cached = context_cache.get(case_id)
+    if cached is not None:
+        return cached
+
+    print("The case id is ",case_id)
+    seen_generation = context_cache.generation(case_id)
+    analyses = mongo.db.analyses.find(
         {"case_id": case_id}, 
         {"predicted_crime": 1, "predicted_crime_type": 1, "confidence_score": 1}
-    ))
+    )
     
     # Format the results into a simple string
-    context = "CASE ANALYSES:\n"
+    lines = ["CASE ANALYSES:"]
     for i, analysis in enumerate(analyses, 1):
-        context += f"Analysis {i}: {analysis.get('predicted_crime_type', 'Unknown')} - {analysis.get('predicted_crime', 'Unknown')} "
+        line = f"Analysis {i}: {analysis.get('predicted_crime_type', 'Unknown')} - {analysis.get('predicted_crime', 'Unknown')} "
         if analysis.get('confidence_score'):
             confidence = float(analysis.get('confidence_score', 0)) * 100
-            context += f"(Confidence: {confidence:.2f}%)"
-        context += "\n"
-    
+            line += f"(Confidence: {confidence:.2f}%)"
+        lines.append(line)
+    context = "\n".join(lines) + "\n"
+
+    context_cache.put(case_id, context, seen_generation)
     return context
 
 def process(query,case_id): 
     try:
-        model = genai.GenerativeModel('gemini-2.0-flash')
+        model = get_genai().GenerativeModel('gemini-2.0-flash')
         context=get_context(case_id)
         prompt = FORENSIC_PROMPT_TEMPLATE(context,query)
         response = model.generate_content(prompt)
@@ -73,199 +127,375 @@ def process(query,case_id):
         return response
     except Exception as e:
         print(f"Error with Gemini API: {e}")
-        model = genai.GenerativeModel('gemini-2.0-flash-lite')
+        model = get_genai().GenerativeModel('gemini-2.0-flash-lite')
         response = model.generate_content(prompt)
-            
-def ask(file):
+        return response
+
+def _chunk_text(chunk):
+    # Gemini chunks expose .text; plain strings are accepted from local clients
+    if isinstance(chunk, str):
+        return chunk
+    return getattr(chunk, 'text', None)
+
+def stream_process(query, case_id, client=None):
+    """
+    Yield the answer text chunk by chunk as the model generates it.
+    client is any object with generate_content(prompt, stream=True), e.g. a fake LLM in tests
+    """
+    context = get_context(case_id)
+    prompt = FORENSIC_PROMPT_TEMPLATE(context, query)
+    models = [client] if client else ['gemini-2.0-flash', 'gemini-2.0-flash-lite']
+
+    for i, model in enumerate(models):
+        if isinstance(model, str):
+            model = get_genai().GenerativeModel(model)
+        started = False
+        try:
+            for chunk in model.generate_content(prompt, stream=True):
+                text = _chunk_text(chunk)
+                if text:
+                    started = True
+                    yield text
+            return
+        except Exception as e:
+            # Fall back to the lighter model only if nothing was sent yet
+            if started or i == len(models) - 1:
+                raise
+            print(f"Error with Gemini API: {e}")
+
+class _DeadlineClient:
+    """
+    Wraps the GAPIC client of a GenerativeModel so every call carries a timeout.
+    google-generativeai 0.3.1 (pinned, langchain-google-genai needs <0.4) has no
+    request_options on generate_content; the client underneath accepts timeout.
+    Its default retry would keep retrying unavailable errors for 60s, so it is off
+    """
+
+    def __init__(self, client, timeout):
+        self._client = client
+        self._timeout = timeout
+
+    def generate_content(self, request, **kwargs):
+        return self._client.generate_content(request, timeout=self._timeout, retry=None, **kwargs)
+
+
+def gemini_model(name, timeout=None):
+    """GenerativeModel whose generate_content calls give up after timeout seconds"""
+    genai = get_genai()
+    model = genai.GenerativeModel(name)
+    if timeout:
+        from google.generativeai import client
+        model._client = _DeadlineClient(client.get_default_generative_client(), timeout)
+    return model
+
+
+def ask(file, timeout=None):
     """
-    Send image to Gemini model to detect objects
+    Send image to Gemini model to detect objects.
+    timeout bounds each Gemini request in seconds; errors are raised to the caller
     """
+    # Handle both file path strings and file objects
+    if isinstance(file, str):
+        # If it's a file path, read the file
+        with open(file, "rb") as f:
+            image_bytes = f.read()
+    else:
+        # If it's a file object (e.g., from Flask's request.files)
+        file.seek(0)  # Reset file pointer to beginning
+        image_bytes = file.read()
+        file.seek(0)  # Reset file pointer again for potential reuse
+    
+    # Encode image to base64
+    image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+    
+    # Create prompt for object detection
+    prompt = "Identify all objects in this image. Return only a comma-separated list of objects."
+    contents = [prompt, {"mime_type": "image/jpeg", "data": image_base64}]
+    deadline = time.time() + timeout if timeout else None
+    
     try:
-        # Handle both file path strings and file objects
-        if isinstance(file, str):
-            # If it's a file path, read the file
-            with open(file, "rb") as f:
-                image_bytes = f.read()
-        else:
-            # If it's a file object (e.g., from Flask's request.files)
-            file.seek(0)  # Reset file pointer to beginning
-            image_bytes = file.read()
-            file.seek(0)  # Reset file pointer again for potential reuse
-        
-        # Encode image to base64
-        import base64
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        # Create prompt for object detection
-        prompt = "Identify all objects in this image. Return only a comma-separated list of objects."
-        
         # Call Gemini model
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content([
-            prompt,
-            {"mime_type": "image/jpeg", "data": image_base64}
-        ])
-        
-        # Process response to get list of objects
-        objects_text = response.text.strip()
-        objects_list = [obj.strip() for obj in objects_text.split(',')]
-        
-        return objects_list
+        model = gemini_model('gemini-2.0-flash', timeout)
+        response = model.generate_content(contents)
     except Exception as e:
         print(f"Error with Gemini API in ask(): {e}")
-        # Fallback to simpler model
-        try:
-            model = genai.GenerativeModel('gemini-2.0-flash-lite')
-            response = model.generate_content(prompt)
-            objects_text = response.text.strip()
-            objects_list = [obj.strip() for obj in objects_text.split(',')]
-            return objects_list
-        except:
-            return ["Error detecting objects"]
-def data(f_h,user_id,case_id,new):
-    response = requests.get(f_h)
-    file_data = response.content
-    file_hash = hashlib.sha256(file_data).hexdigest()
+        # Fallback to simpler model within what is left of the timeout; its errors reach the caller
+        remaining = deadline - time.time() if deadline else None
+        if remaining is not None and remaining <= 0:
+            raise
+        model = gemini_model('gemini-2.0-flash-lite', remaining)
+        response = model.generate_content(contents)
+    
+    # Process response to get list of objects
+    objects_text = response.text.strip()
+    objects_list = [obj.strip() for obj in objects_text.split(',')]
+    
+    return objects_list
+def data(file_hash,user_id,case_id,new,url=None):
+    # The hash is normally computed from the uploaded bytes; only externally
+    # supplied URLs without a known hash are downloaded to compute it
+    if file_hash is None and url:
+        response = requests.get(url)
+        response.raise_for_status()
+        file_hash = hashlib.sha256(response.content).hexdigest()
     print(file_hash)
     image_id=I.get_id_by_file_hash(file_hash)
     Analysis.add_detected_object(case_id,user_id,image_id,new)
 
 
-def compute_file_hash(file):
+def compute_file_hash(file, chunk_size=1024 * 1024):
+    hasher = hashlib.sha256()
     if isinstance(file, str):  # File path
         with open(file, "rb") as f:
-            file_data = f.read()
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+    elif isinstance(file, (bytes, bytearray)):  # Already bytes
+        hasher.update(file)
     elif hasattr(file, "read"):  # File-like object (e.g., from Flask)
-        file_data = file.read()
-    elif isinstance(file, bytes):  # Already bytes
-        file_data = file
+        # Hash the bytes already held by the upload and rewind it for the next reader
+        file.seek(0)
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            hasher.update(chunk)
+        file.seek(0)
     else:
         raise ValueError("Unsupported file type for hashing.")
 
-    return hashlib.sha256(file_data).hexdigest()
-def yolo(file,user_id,case_id):
+    return hasher.hexdigest()
+def run_yolo(img_array, timeout=None):
+    """Run inference on the process-wide YOLO instance, waiting at most timeout seconds for it"""
+    with use_model("yolo", timeout=timeout) as model:
+        return model.names, model(img_array)
+
+
+def run_stage(func, deadline, *args):
+    """
+    Call func(*args, timeout=...) with the time left until deadline, so the call
+    itself gives up (and frees its worker) instead of only the caller's wait
+    """
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise FutureTimeoutError("deadline passed before the stage started")
+    return func(*args, timeout=remaining)
+
+
+def submit_stages(stages, started):
+    """
+    Submit {name: (func, *args)} to stage_pool, each bounded by its YOLO_STAGE_TIMEOUTS
+    entry (measured from started)
+    """
+    return {
+        name: stage_pool.submit(run_stage, func, started + YOLO_STAGE_TIMEOUTS[name], *args)
+        for name, (func, *args) in stages.items()
+    }
+
+
+def collect_stages(futures, started):
+    """
+    Wait for each stage up to its own timeout (measured from submission).
+    Returns the results of the stages that finished and an error per stage that didn't
+    """
+    stages, errors = {}, {}
+    for name, future in futures.items():
+        timeout = YOLO_STAGE_TIMEOUTS[name]
+        try:
+            stages[name] = future.result(timeout=max(0, started + timeout - time.time()))
+        except FutureTimeoutError:
+            # A stage still queued is dropped; a running one stops at its own timeout
+            future.cancel()
+            errors[name] = f"timed out after {timeout:.0f}s"
+        except Exception as e:
+            errors[name] = str(e)
+        if name in errors:
+            print(f"YOLO stage '{name}' failed: {errors[name]}")
+    return stages, errors
+
+
+# Distinct colors for different object classes, assigned in order of first detection
+BOX_COLORS = [
+    (255, 0, 0),     # Red
+    (0, 255, 0),     # Green
+    (0, 0, 255),     # Blue
+    (255, 255, 0),   # Yellow
+    (255, 0, 255),   # Magenta
+    (0, 255, 255),   # Cyan
+    (128, 0, 0),     # Maroon
+    (0, 128, 0),     # Dark Green
+    (0, 0, 128),     # Navy
+    (128, 128, 0),   # Olive
+    (128, 0, 128),   # Purple
+    (0, 128, 128),   # Teal
+    (255, 165, 0),   # Orange
+    (255, 192, 203), # Pink
+    (173, 216, 230)  # Light Blue
+]
+
+
+def extract_boxes(results):
+    """
+    Collect the boxes of every YOLO result as whole arrays, without touching
+    individual box tensors. Returns (xyxy float32 Nx4, confidence float32 N, class_ids int32 N)
+    """
+    import numpy as np
+    xyxy, confidence, class_ids = [], [], []
+    for r in results:
+        boxes = r.boxes.cpu().numpy()
+        xyxy.append(boxes.xyxy)
+        confidence.append(boxes.conf)
+        class_ids.append(boxes.cls)
+    if not xyxy:
+        return np.zeros((0, 4), np.float32), np.zeros(0, np.float32), np.zeros(0, np.int32)
+    return (np.concatenate(xyxy).astype(np.float32),
+            np.concatenate(confidence).astype(np.float32),
+            np.concatenate(class_ids).astype(np.int32))
+
+
+def boxes_as_rows(xyxy, confidence, class_ids, names):
+    # One dict per box, the original response format
+    return [
+        {"x1": x1, "y1": y1, "x2": x2, "y2": y2, "confidence": conf, "class": names[cls]}
+        for (x1, y1, x2, y2), conf, cls in zip(xyxy.tolist(), confidence.tolist(), class_ids.tolist())
+    ]
+
+
+def boxes_as_columns(xyxy, confidence, class_ids, names):
+    # One list per field; class names are listed once instead of per box
+    return {
+        "xyxy": xyxy.tolist(),
+        "confidence": confidence.tolist(),
+        "class_id": class_ids.tolist(),
+        "names": {str(cls): names[cls] for cls in set(class_ids.tolist())}
+    }
+
+
+def draw_boxes(img_array, xyxy, confidence, class_ids, names, max_dim=0):
+    """Draw labelled boxes on a copy of the image, downscaled first so its longest side fits max_dim"""
+    import numpy as np
+    import cv2
+
+    # 1. Scale the image once, and all box coordinates with one array operation
+    height, width = img_array.shape[:2]
+    scale = max_dim / max(height, width) if max_dim and max(height, width) > max_dim else 1.0
+    if scale < 1.0:
+        canvas = cv2.resize(img_array, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+    else:
+        canvas = img_array.copy()
+    xyxy = np.round(xyxy * scale).astype(np.int32)
+    canvas = np.ascontiguousarray(canvas)
+
+    # 2. Colors by class in order of first detection
+    _, first = np.unique(class_ids, return_index=True)
+    class_color_map = {cls: BOX_COLORS[i % len(BOX_COLORS)] for i, cls in enumerate(class_ids[np.sort(first)].tolist())}
+
+    for (x1, y1, x2, y2), conf, cls in zip(xyxy.tolist(), confidence.tolist(), class_ids.tolist()):
+        color = class_color_map[cls]
+        # Draw rectangle with thicker border
+        cv2.rectangle(canvas, (x1, y1), (x2, y2), color, 3)
+
+        # Label on a filled background to make it more readable
+        text = f"{names[cls]} ({conf:.2f})"
+        text_size, _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
+        cv2.rectangle(canvas, (x1, y1 - text_size[1] - 10), (x1 + text_size[0], y1), color, -1)
+        cv2.putText(canvas, text, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+    return canvas
+
+
+def yolo(file,user_id,case_id,options=None,budget=None):
+    """
+    Detect objects in one image. options come from annotated_options(); with the
+    "multipart" output mode annotated_image holds the encoded bytes and
+    annotated_mime their type, for the route to send as their own part.
+    budget is the request's PixelBudget when several images share one.
+    Box coordinates are in pixels of the original image.
+    Returns None if the image could not be processed; raises ImageBudgetExceeded
+    when the budget is used up, so the caller can tell the user why
+    """
+    options = options or annotated_options()
+    # Imaging libraries are only loaded by processes that run detection
+    import numpy as np
     try:
-        # If file is a path string, open it
-        temp=upload_pil(file)
-        if isinstance(file, str):
+        started = time.time()
+
+        # Read the upload once; every stage gets its own stream over the same bytes
+        image_bytes = read_bytes(file)
+        file_hash = compute_file_hash(image_bytes)
 
-            image = Image.open(file)
-        # If file is a FileStorage object from Flask
+        # Decode only as large as YOLO's input or the annotated output needs
+        if not options["annotate"]:
+            load_side = YOLO_INPUT_SIZE
+        elif options["max_dim"]:
+            load_side = max(YOLO_INPUT_SIZE, options["max_dim"])
         else:
-            image = Image.open(file)
-        
-        # Convert PIL Image to numpy array for YOLO processing
-        img_array = np.array(image)
-        
-        # Load YOLO model
-        model = YOLO("yolov8n.pt")  # Use the default YOLOv8 nano model
-        
-        # Run inference
-        results = model(img_array)
-        
+            load_side = None
+        loaded = load_image(image_bytes, max_side=load_side, budget=budget or PixelBudget())
+        img_array = np.asarray(loaded.image)
+
+        # Upload, inference and labeling don't depend on each other
+        futures = submit_stages({
+            "upload": (upload_original, image_bytes),
+            "inference": (run_yolo, img_array),
+            "labels": (ask, BytesIO(image_bytes)),
+        }, started)
+        stages, errors = collect_stages(futures, started)
+
+        temp = stages.get("upload") or {}
+        model_names, results = stages.get("inference") or ({}, [])
+
         # Get detected objects from Gemini for better labels
-        detected_objects = ask(file)
-        data(temp["secure_url"],user_id,case_id,detected_objects)
-        # Define a list of distinct colors for different objects
-        colors = [
-            (255, 0, 0),     # Red
-            (0, 255, 0),     # Green
-            (0, 0, 255),     # Blue
-            (255, 255, 0),   # Yellow
-            (255, 0, 255),   # Magenta
-            (0, 255, 255),   # Cyan
-            (128, 0, 0),     # Maroon
-            (0, 128, 0),     # Dark Green
-            (0, 0, 128),     # Navy
-            (128, 128, 0),   # Olive
-            (128, 0, 128),   # Purple
-            (0, 128, 128),   # Teal
-            (255, 165, 0),   # Orange
-            (255, 192, 203), # Pink
-            (173, 216, 230)  # Light Blue
-        ]
-        
-        # Process results to get bounding boxes
-        boxes = []
-        class_color_map = {}  # Map class names to colors
-        color_index = 0
-        
-        for r in results:
-            for box in r.boxes:
-                x1, y1, x2, y2 = box.xyxy[0].tolist()  # Get box coordinates
-                conf = float(box.conf[0])  # Get confidence
-                cls = int(box.cls[0])  # Get class
-                class_name = model.names[cls]  # Get class name
-                
-                # Assign a color to this class if not already assigned
-                if class_name not in class_color_map:
-                    class_color_map[class_name] = colors[color_index % len(colors)]
-                    color_index += 1
-                
-                boxes.append({
-                    "x1": int(x1),
-                    "y1": int(y1),
-                    "x2": int(x2),
-                    "y2": int(y2),
-                    "confidence": conf,
-                    "class": class_name
-                })
-        
-        # Draw bounding boxes on the image
-        img_with_boxes = img_array.copy()
-        for box in boxes:
-            # Get color for this class
-            color = class_color_map[box['class']]
-            
-            # Draw rectangle with thicker border
-            cv2.rectangle(
-                img_with_boxes, 
-                (box["x1"], box["y1"]), 
-                (box["x2"], box["y2"]), 
-                color, 
-                3  # Thicker line
-            )
-            
-            # Create a background for the text to make it more readable
-            text = f"{box['class']} ({box['confidence']:.2f})"
-            text_size, _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.7, 2)
-            cv2.rectangle(
-                img_with_boxes,
-                (box["x1"], box["y1"] - text_size[1] - 10),
-                (box["x1"] + text_size[0], box["y1"]),
-                color,
-                -1  # Filled rectangle
-            )
-            
-            # Add label with larger font and white text
-            cv2.putText(
-                img_with_boxes, 
-                text, 
-                (box["x1"], box["y1"] - 5), 
-                cv2.FONT_HERSHEY_SIMPLEX, 
-                0.7,  # Larger font
-                (255, 255, 255),  # White text
-                2  # Thicker text
-            )
-        
-        # Convert numpy array back to PIL Image
-        annotated_image = Image.fromarray(img_with_boxes)
-        
-        # Convert to base64 for sending to frontend
-        buffered = io.BytesIO()
-        annotated_image.save(buffered, format="JPEG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        # Create a data URL for the image
-        img_data_url = f"data:image/jpeg;base64,{img_str}"
+        detected_objects = stages.get("labels") or []
+        if "labels" not in errors:
+            data(file_hash,user_id,case_id,detected_objects)
+        # All boxes of the image as arrays, converted in one pass
+        xyxy, confidence, class_ids = extract_boxes(results)
+        original_xyxy = (xyxy / loaded.scale).astype(np.int32)
+        if options["boxes"] == "columns":
+            boxes = boxes_as_columns(original_xyxy, confidence, class_ids, model_names)
+        else:
+            boxes = boxes_as_rows(original_xyxy, confidence, class_ids, model_names)
+
+        if not options["annotate"]:
+            print(f"Detected {len(confidence)} boxes")
+            return {
+                "detected_objects": detected_objects,
+                "boxes": boxes,
+                "annotated_image": None,
+                "annotated_mime": None,
+                "image_url": temp.get("secure_url"),
+                "processing_time": round(time.time() - started, 3),  # seconds
+                "errors": errors
+            }
+
+        # Draw bounding boxes on a copy already scaled down to the output size
+        img_with_boxes = draw_boxes(img_array, xyxy, confidence, class_ids, model_names, options["max_dim"])
+
+        # Encode once in the requested format and size
+        annotated_bytes, annotated_mime = encode_annotated(img_with_boxes, options)
+
+        if options["output"] == "url":
+            # Store the annotated image next to the original and return its link
+            try:
+                annotated_image = get_cloudinary_uploader().upload(BytesIO(annotated_bytes)).get("secure_url")
+            except Exception as e:
+                errors["annotated_upload"] = str(e)
+                annotated_image = None
+        elif options["output"] == "multipart":
+            annotated_image = annotated_bytes
+        else:
+            # Create a data URL for the image
+            img_str = base64.b64encode(annotated_bytes).decode()
+            annotated_image = f"data:{annotated_mime};base64,{img_str}"
         
-        print(f"Generated annotated image with {len(boxes)} boxes")
+        print(f"Generated annotated image with {len(confidence)} boxes")
         return {
             "detected_objects": detected_objects,
             "boxes": boxes,
-            "annotated_image": img_data_url,
-            "processing_time": 0.5  # seconds
+            "annotated_image": annotated_image,
+            "annotated_mime": annotated_mime,
+            "image_url": temp.get("secure_url"),
+            "processing_time": round(time.time() - started, 3),  # seconds
+            "errors": errors
         }
+    except ImageBudgetExceeded:
+        raise
     except Exception as e:
         print(f"Error in YOLO processing: {e}")
         import traceback
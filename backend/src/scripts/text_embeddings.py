@@ -0,0 +1,108 @@
+import os
+import hashlib
+import threading
+from collections import namedtuple
+from config.config import data_set
+
+# Directory holding the persisted text embeddings (one file per model + dataset version)
+CACHE_DIR = os.getenv(
+    "CLIP_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), ".cache")
+)
+
+TextEmbeddings = namedtuple("TextEmbeddings", ["descriptions", "crime_types", "features"])
+
+_lock = threading.Lock()
+_embeddings = {}  # model_name -> TextEmbeddings
+_dataset = None  # (DataFrame, content hash), loaded once per process
+
+
+def dataset_hash(df):
+    """Hash the dataset contents so the cache is rebuilt whenever the CSV changes"""
+    return hashlib.sha256(df.to_csv(index=False).encode("utf-8")).hexdigest()
+
+
+def load_dataset():
+    """Load the crime dataset and its content hash once per process"""
+    global _dataset
+    if _dataset is None:
+        df = data_set()
+        if df is None:
+            raise RuntimeError("Crime dataset is not available")
+        _dataset = (df, dataset_hash(df))
+    return _dataset
+
+
+def model_version(model_name):
+    """Identify the predictions of a model against the current dataset"""
+    _, data_hash = load_dataset()
+    return f"{model_name}:{data_hash[:16]}"
+
+
+def cache_path(model_name, data_hash):
+    safe_name = model_name.replace("/", "_")
+    return os.path.join(CACHE_DIR, f"clip_text_{safe_name}_{data_hash[:16]}.pt")
+
+
+def _encode(model, processor, descriptions):
+    import torch
+    text_inputs = processor(text=descriptions, return_tensors="pt", padding=True)
+    with torch.no_grad():
+        text_features = model.get_text_features(**text_inputs)
+    # Normalise once so cosine similarity becomes a plain matrix product per image
+    return torch.nn.functional.normalize(text_features, dim=-1)
+
+
+def _load_or_build(model, processor, model_name):
+    import torch
+
+    df, data_hash = load_dataset()
+    descriptions = df["Crime Description"].tolist()
+    crime_types = df["Crime Type"].tolist()
+    path = cache_path(model_name, data_hash)
+
+    # 1. Reuse the embeddings stored on disk for this model and dataset version
+    if os.path.exists(path):
+        try:
+            stored = torch.load(path)
+            if stored.get("model_name") == model_name and stored.get("dataset_hash") == data_hash:
+                print(f"✅ Loaded cached CLIP text embeddings from {path}")
+                return TextEmbeddings(stored["descriptions"], stored["crime_types"], stored["features"])
+        except Exception as e:
+            print(f"Error reading text embedding cache {path}: {e}")
+
+    # 2. Encode the dataset once and persist it for the next process
+    features = _encode(model, processor, descriptions)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        torch.save({
+            "model_name": model_name,
+            "dataset_hash": data_hash,
+            "descriptions": descriptions,
+            "crime_types": crime_types,
+            "features": features,
+        }, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"✅ Cached CLIP text embeddings at {path}")
+    except Exception as e:
+        print(f"Error writing text embedding cache {path}: {e}")
+
+    return TextEmbeddings(descriptions, crime_types, features)
+
+
+def get_text_embeddings(model, processor, model_name):
+    """
+    Return the normalised CLIP text embeddings for every crime description,
+    building them at most once per process
+    """
+    embeddings = _embeddings.get(model_name)
+    if embeddings is not None:
+        return embeddings
+
+    with _lock:
+        embeddings = _embeddings.get(model_name)
+        if embeddings is None:
+            embeddings = _load_or_build(model, processor, model_name)
+            _embeddings[model_name] = embeddings
+        return embeddings
@@ -0,0 +1,84 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# Chat context strings per case, invalidated whenever an analysis of the case changes.
+# The TTL bounds staleness from writes made by other worker processes.
+CONTEXT_CACHE_TTL = float(os.getenv("CONTEXT_CACHE_TTL", "300"))
+CONTEXT_CACHE_SIZE = int(os.getenv("CONTEXT_CACHE_SIZE", "1024"))
+
+_lock = threading.Lock()
+_entries = OrderedDict()  # case_id -> (context, expires_at)
+# case_id -> value of _counter at its last invalidation, for the most recently
+# invalidated cases. Cases dropped from it read as _floor, the newest generation
+# dropped so far, so a context built before the drop still can't be cached
+_generations = OrderedDict()
+_counter = 0
+_floor = 0
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def generation(case_id):
+    """
+    Return the current generation of a case. Read it before querying MongoDB and
+    pass it to put(), so a context built concurrently with a write is not cached
+    """
+    with _lock:
+        return _generations.get(str(case_id), _floor)
+
+
+def get(case_id):
+    """
+    Retrieve the cached context for a case
+
+    Args:
+        case_id: The ID of the case
+
+    Returns:
+        The context string, or None if it is missing or expired
+    """
+    key = str(case_id)
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry[1] > time.monotonic():
+            _entries.move_to_end(key)
+            _stats["hits"] += 1
+            return entry[0]
+        if entry:
+            del _entries[key]
+        _stats["misses"] += 1
+        return None
+
+
+def put(case_id, context, seen_generation):
+    key = str(case_id)
+    with _lock:
+        if _generations.get(key, _floor) != seen_generation:
+            return
+        _entries[key] = (context, time.monotonic() + CONTEXT_CACHE_TTL)
+        _entries.move_to_end(key)
+        while len(_entries) > CONTEXT_CACHE_SIZE:
+            _entries.popitem(last=False)
+
+
+def invalidate(case_id):
+    """Drop the cached context of a case after one of its analyses changed"""
+    if case_id is None:
+        return
+    global _counter, _floor
+    key = str(case_id)
+    with _lock:
+        _entries.pop(key, None)
+        _counter += 1
+        _generations[key] = _counter
+        _generations.move_to_end(key)
+        while len(_generations) > CONTEXT_CACHE_SIZE:
+            _, dropped = _generations.popitem(last=False)
+            _floor = max(_floor, dropped)
+        _stats["invalidations"] += 1
+
+
+def stats():
+    with _lock:
+        return dict(_stats, size=len(_entries), generations=len(_generations))
@@ -0,0 +1,336 @@
+import os
+import time
+import uuid
+import queue
+import threading
+import traceback
+from datetime import datetime, timedelta
+
+# Backend used to hold queued analysis jobs: "memory" (in-process queue) or "mongo"
+ANALYSIS_JOB_BACKEND = os.getenv("ANALYSIS_JOB_BACKEND", "memory")
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+# Finished jobs kept by the in-memory backend before the oldest are dropped
+ANALYSIS_JOB_RETENTION = int(os.getenv("ANALYSIS_JOB_RETENTION", "500"))
+# Seconds an idle Mongo worker waits before polling for new jobs again
+ANALYSIS_JOB_POLL_INTERVAL = float(os.getenv("ANALYSIS_JOB_POLL_INTERVAL", "1.0"))
+# Seconds a running Mongo job may go without a heartbeat before another worker takes it over
+ANALYSIS_JOB_LEASE = float(os.getenv("ANALYSIS_JOB_LEASE", "300"))
+# Claims of one job before it is failed instead of requeued again
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv("ANALYSIS_JOB_MAX_ATTEMPTS", "3"))
+
+
+def _new_job(kind, case_id, user_id, filenames):
+    now = datetime.utcnow()
+    return {
+        "_id": uuid.uuid4().hex,
+        "kind": kind,
+        "case_id": case_id,
+        "user_id": user_id,
+        "status": "queued",
+        "total": len(filenames),
+        "completed": 0,
+        "items": [
+            {"filename": filename, "status": "queued", "result": None, "error": None}
+            for filename in filenames
+        ],
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+        "heartbeat_at": None,
+        "finished_at": None,
+    }
+
+
+def public_view(job):
+    """
+    Convert a stored job into the status payload returned to clients
+
+    Args:
+        job: The stored job document
+
+    Returns:
+        Dictionary with the job status, per-image progress and results
+    """
+    return {
+        "job_id": job["_id"],
+        "kind": job["kind"],
+        "case_id": job["case_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "progress": job["completed"] / job["total"] if job["total"] else 1.0,
+        "items": [
+            {key: item.get(key) for key in ("filename", "status", "result", "error")}
+            for item in job["items"]
+        ],
+        "created_at": job["created_at"].isoformat() + "Z",
+        "finished_at": job["finished_at"].isoformat() + "Z" if job["finished_at"] else None,
+    }
+
+
+class MemoryJobStore:
+    """In-process job store backed by a queue, for single-process servers and tests"""
+
+    # Jobs die with the process, so there is no other worker to hand them over to
+    lease = None
+
+    def __init__(self, retention=ANALYSIS_JOB_RETENTION):
+        self._jobs = {}
+        self._payloads = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._retention = retention
+
+    def create(self, kind, case_id, user_id, items):
+        job = _new_job(kind, case_id, user_id, [filename for filename, _ in items])
+        with self._lock:
+            self._jobs[job["_id"]] = job
+            self._payloads[job["_id"]] = [data for _, data in items]
+        self._queue.put(job["_id"])
+        return job["_id"]
+
+    def claim(self, timeout=None):
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None, None
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["updated_at"] = job["heartbeat_at"] = datetime.utcnow()
+            return job_id, (job["kind"], job["case_id"], job["user_id"], job["items"], self._payloads[job_id])
+
+    def update_item(self, job_id, index, status, result=None, error=None):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["items"][index].update(status=status, result=result, error=error)
+            job["completed"] = sum(1 for item in job["items"] if item["status"] in ("completed", "failed"))
+            job["updated_at"] = datetime.utcnow()
+
+    def finish(self, job_id, status):
+        with self._lock:
+            job = self._jobs[job_id]
+            job["status"] = status
+            job["finished_at"] = job["updated_at"] = datetime.utcnow()
+            self._payloads.pop(job_id, None)
+            self._prune()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return public_view(job) if job else None
+
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job["finished_at"]]
+        if len(finished) > self._retention:
+            finished.sort(key=lambda job: job["finished_at"])
+            for job in finished[:len(finished) - self._retention]:
+                del self._jobs[job["_id"]]
+
+
+class MongoJobStore:
+    """
+    Job store shared by every worker process through MongoDB. Job documents live in
+    analysis_jobs and uploaded images in the analysis_job_files GridFS bucket.
+
+    A claimed job is leased: its worker renews heartbeat_at while it runs, and a
+    running job whose heartbeat is older than the lease (its process died or was
+    restarted) is claimed again, up to max_attempts times
+    """
+
+    def __init__(self, db=None, poll_interval=ANALYSIS_JOB_POLL_INTERVAL,
+                 lease=ANALYSIS_JOB_LEASE, max_attempts=ANALYSIS_JOB_MAX_ATTEMPTS):
+        import gridfs
+        if db is None:
+            from config.db import mongo
+            db = mongo.db
+        self._jobs = db.analysis_jobs
+        self._files = gridfs.GridFS(db, collection="analysis_job_files")
+        self._poll_interval = poll_interval
+        self.lease = lease
+        self._max_attempts = max_attempts
+
+    def create(self, kind, case_id, user_id, items):
+        job = _new_job(kind, case_id, user_id, [filename for filename, _ in items])
+        for item, (filename, data) in zip(job["items"], items):
+            item["file_id"] = self._files.put(data, filename=filename, job_id=job["_id"])
+        self._jobs.insert_one(job)
+        return job["_id"]
+
+    def claim(self, timeout=None):
+        from pymongo import ReturnDocument
+        deadline = time.time() + (timeout or 0)
+        while True:
+            now = datetime.utcnow()
+            expired = {"status": "running", "heartbeat_at": {"$lt": now - timedelta(seconds=self.lease)}}
+            # 1. Jobs that keep outliving their workers are given up on
+            for stale in self._jobs.find({**expired, "attempts": {"$gte": self._max_attempts}}, {"_id": 1}):
+                # Matching the expired lease again keeps a concurrent claim from failing it twice
+                job = self._jobs.find_one_and_update(
+                    {"_id": stale["_id"], **expired},
+                    {"$set": {"status": "failed", "finished_at": now, "updated_at": now}},
+                )
+                self._delete_files(job)
+            # 2. Take the oldest queued job, or one whose lease expired
+            job = self._jobs.find_one_and_update(
+                {"$or": [{"status": "queued"}, expired]},
+                {"$set": {"status": "running", "updated_at": now, "heartbeat_at": now}, "$inc": {"attempts": 1}},
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER,
+            )
+            if job:
+                payloads = [self._files.get(item["file_id"]).read() for item in job["items"]]
+                return job["_id"], (job["kind"], job["case_id"], job["user_id"], job["items"], payloads)
+            if time.time() >= deadline:
+                return None, None
+            time.sleep(self._poll_interval)
+
+    def heartbeat(self, job_id):
+        self._jobs.update_one({"_id": job_id, "status": "running"}, {"$set": {"heartbeat_at": datetime.utcnow()}})
+
+    def update_item(self, job_id, index, status, result=None, error=None):
+        prefix = f"items.{index}"
+        now = datetime.utcnow()
+        # An item finished by an earlier claim of the job is not counted twice
+        self._jobs.update_one(
+            {"_id": job_id, f"{prefix}.status": {"$nin": ["completed", "failed"]}},
+            {
+                "$set": {
+                    f"{prefix}.status": status,
+                    f"{prefix}.result": result,
+                    f"{prefix}.error": error,
+                    "updated_at": now,
+                    "heartbeat_at": now,
+                },
+                "$inc": {"completed": 1},
+            },
+        )
+
+    def finish(self, job_id, status):
+        now = datetime.utcnow()
+        job = self._jobs.find_one_and_update(
+            {"_id": job_id},
+            {"$set": {"status": status, "finished_at": now, "updated_at": now}},
+        )
+        self._delete_files(job)
+
+    def _delete_files(self, job):
+        # Uploaded images are only needed until the job has run
+        for item in (job or {}).get("items", []):
+            if item.get("file_id"):
+                self._files.delete(item["file_id"])
+
+    def get(self, job_id):
+        job = self._jobs.find_one({"_id": job_id})
+        return public_view(job) if job else None
+
+
+class JobQueue:
+    """
+    Runs submitted analysis jobs on a pool of background worker threads.
+
+    handlers maps a job kind to a function(items, case_id, user_id) that yields
+    (index, result, error) as each image finishes, so progress is recorded per image.
+    """
+
+    def __init__(self, store, handlers, workers=ANALYSIS_JOB_WORKERS):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers
+        self._threads = []
+        self._pid = None
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        # Called at app start and again on use: a pre-fork server's workers don't
+        # inherit the threads, so each process starts its own
+        with self._start_lock:
+            if self._threads and self._pid == os.getpid():
+                return
+            self._threads = []
+            self._pid = os.getpid()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"analysis-job-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, kind, items, case_id=None, user_id=None):
+        """
+        Queue a job for background processing
+
+        Args:
+            kind: Handler name, e.g. "analyze" or "analyze_images"
+            items: List of (filename, image bytes) pairs
+            case_id: Case the images belong to
+            user_id: User submitting the images
+
+        Returns:
+            The job ID to poll for status
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        self.start()
+        return self.store.create(kind, case_id, user_id, items)
+
+    def status(self, job_id):
+        self.start()
+        return self.store.get(job_id)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                job_id, job = self.store.claim(timeout=1.0)
+            except Exception as e:
+                print(f"Error claiming analysis job: {e}")
+                time.sleep(1.0)
+                continue
+            if job_id is None:
+                continue
+            self._process(job_id, *job)
+
+    def _heartbeat(self, job_id, done, interval):
+        # Renews the job's lease while a long image keeps the worker busy
+        while not done.wait(interval):
+            try:
+                self.store.heartbeat(job_id)
+            except Exception as e:
+                print(f"Error renewing analysis job {job_id}: {e}")
+
+    def _process(self, job_id, kind, case_id, user_id, items, payloads):
+        # Items finished before a requeue keep their results
+        pending = [
+            (index, item["filename"], data)
+            for index, (item, data) in enumerate(zip(items, payloads))
+            if item["status"] not in ("completed", "failed")
+        ]
+        failures = sum(1 for item in items if item["status"] == "failed")
+        done = threading.Event()
+        if self.store.lease:
+            threading.Thread(target=self._heartbeat, args=(job_id, done, self.store.lease / 3), daemon=True).start()
+        try:
+            for index, result, error in self.handlers[kind](pending, case_id, user_id):
+                failures += error is not None
+                self.store.update_item(job_id, index, "failed" if error else "completed", result, error)
+            self.store.finish(job_id, "failed" if items and failures == len(items) else "completed")
+        except Exception as e:
+            print(f"Error processing analysis job {job_id}: {e}")
+            traceback.print_exc()
+            self.store.finish(job_id, "failed")
+        finally:
+            done.set()
+
+
+def create_store(backend=ANALYSIS_JOB_BACKEND):
+    if backend == "mongo":
+        return MongoJobStore()
+    if backend == "memory":
+        return MemoryJobStore()
+    raise ValueError(f"Unknown analysis job backend '{backend}'")
@@ -0,0 +1,176 @@
+"""
+Background dispatcher for outbound email.
+
+Routes queue a flask_mail.Message and return immediately; a worker thread sends
+queued messages in batches over one SMTP connection, which stays open while
+messages keep arriving and is closed after MAIL_IDLE_TIMEOUT seconds without any.
+
+The SMTP server comes from init_mail (config/config.py) and can be pointed at a
+local stand-in, e.g.
+
+    python -m aiosmtpd -n -l localhost:1025
+    MAIL_SERVER=localhost MAIL_PORT=1025 MAIL_USE_TLS=0 python app.py
+"""
+import os
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+MAIL_QUEUE_SIZE = int(os.getenv("MAIL_QUEUE_SIZE", "1000"))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "50"))
+MAIL_IDLE_TIMEOUT = float(os.getenv("MAIL_IDLE_TIMEOUT", "30"))
+# Delivery statuses kept before the oldest finished ones are dropped
+MAIL_STATUS_RETENTION = int(os.getenv("MAIL_STATUS_RETENTION", "1000"))
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+class MailDispatcher:
+    def __init__(self, maxsize=MAIL_QUEUE_SIZE, batch_size=MAIL_BATCH_SIZE,
+                 idle_timeout=MAIL_IDLE_TIMEOUT, retention=MAIL_STATUS_RETENTION):
+        self.app = None
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.retention = retention
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._statuses = OrderedDict()  # message_id -> status dict
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions["mail_dispatcher"] = self
+
+    def start(self):
+        # Started on first use so pre-fork servers get one worker per process
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="mail-dispatcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, message):
+        """
+        Queue a message for delivery
+
+        Args:
+            message: A flask_mail.Message
+
+        Returns:
+            The message ID to look up its delivery status
+
+        Raises:
+            MailQueueFull: If the queue already holds MAIL_QUEUE_SIZE messages
+        """
+        self.start()
+        message_id = uuid.uuid4().hex
+        with self._lock:
+            self._statuses[message_id] = {
+                "message_id": message_id,
+                "status": "queued",
+                "error": None,
+                "queued_at": datetime.utcnow().isoformat() + "Z",
+                "sent_at": None,
+            }
+        try:
+            self._queue.put_nowait((message_id, message))
+        except queue.Full:
+            self._set_status(message_id, "failed", error="Mail queue is full")
+            raise MailQueueFull("Mail queue is full")
+        return message_id
+
+    def status(self, message_id):
+        with self._lock:
+            status = self._statuses.get(message_id)
+            return dict(status) if status else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for status in self._statuses.values():
+                counts[status["status"]] = counts.get(status["status"], 0) + 1
+        return dict(counts, queue_depth=self._queue.qsize())
+
+    def _set_status(self, message_id, status, error=None):
+        with self._lock:
+            entry = self._statuses.get(message_id)
+            if entry is None:
+                return
+            entry.update(status=status, error=error)
+            if status == "sent":
+                entry["sent_at"] = datetime.utcnow().isoformat() + "Z"
+            if status in ("sent", "failed"):
+                self._prune()
+
+    def _prune(self):
+        finished = [k for k, s in self._statuses.items() if s["status"] in ("sent", "failed")]
+        for message_id in finished[:max(0, len(finished) - self.retention)]:
+            del self._statuses[message_id]
+
+    def _next_batch(self, timeout):
+        # Block for the first message, then take whatever else is already queued
+        try:
+            batch = [self._queue.get(timeout=timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        from config.config import mail
+        with self.app.app_context():
+            while True:
+                # 1. Wait for work without holding a connection open
+                batch = self._next_batch(timeout=None)
+                connection = None
+                try:
+                    # 2. Keep one connection for as long as messages keep arriving
+                    while batch:
+                        for message_id, message in batch:
+                            self._set_status(message_id, "sending")
+                            connection = self._send(mail, connection, message_id, message)
+                        batch = self._next_batch(timeout=self.idle_timeout)
+                finally:
+                    # 3. Idle: close the connection until the next message
+                    self._close(connection)
+
+    def _send(self, mail, connection, message_id, message):
+        # One reconnect per message covers servers that dropped an idle connection
+        for attempt in (1, 2):
+            try:
+                if connection is None:
+                    connection = mail.connect()
+                    connection.__enter__()
+                connection.send(message)
+                self._set_status(message_id, "sent")
+                print(f"Mail {message_id} sent to {', '.join(message.recipients)}")
+                return connection
+            except OSError as e:  # socket and smtplib errors
+                self._close(connection)
+                connection = None
+                if attempt == 2:
+                    print(f"Error sending mail {message_id}: {e}")
+                    self._set_status(message_id, "failed", error=str(e))
+            except Exception as e:
+                print(f"Error sending mail {message_id}: {e}")
+                self._set_status(message_id, "failed", error=str(e))
+                return connection
+        return connection
+
+    def _close(self, connection):
+        if connection is None:
+            return
+        try:
+            connection.__exit__(None, None, None)
+        except Exception as e:
+            print(f"Error closing SMTP connection: {e}")
+
+
+mailer = MailDispatcher()
@@ -0,0 +1,107 @@
+import os
+import hmac
+import secrets
+import threading
+from datetime import datetime, timedelta
+
+# Backend holding issued OTP codes: "memory" (single process) or "mongo" (shared by every worker)
+OTP_BACKEND = os.getenv("OTP_BACKEND", "memory")
+
+# Results of OTPStore.verify
+VALID = "valid"
+INVALID = "invalid"
+EXPIRED = "expired"
+MISSING = "missing"
+
+
+def generate_code(digits=6):
+    return "".join(secrets.choice("0123456789") for _ in range(digits))
+
+
+def _check(entry, code, now):
+    if entry is None:
+        return MISSING
+    if now > entry["expires_at"]:
+        return EXPIRED
+    if not hmac.compare_digest(str(code or "").encode(), entry["code"].encode()):
+        return INVALID
+    return VALID
+
+
+class MemoryOTPStore:
+    """In-process OTP store, for single-process servers and development"""
+
+    def __init__(self):
+        self._codes = {}  # key -> {"code", "email", "expires_at"}
+        self._lock = threading.Lock()
+
+    def issue(self, key, email, ttl_seconds):
+        """
+        Create a new code for key, replacing any earlier one
+
+        Args:
+            key: Who the code belongs to, e.g. the user ID from the JWT
+            email: Address the code is sent to
+            ttl_seconds: Seconds until the code expires
+
+        Returns:
+            Tuple of (code, expires_at)
+        """
+        now = datetime.utcnow()
+        entry = {"code": generate_code(), "email": email, "expires_at": now + timedelta(seconds=ttl_seconds)}
+        with self._lock:
+            # Drop expired codes of other users so the dict stays bounded
+            for other in [k for k, e in self._codes.items() if now > e["expires_at"]]:
+                del self._codes[other]
+            self._codes[key] = entry
+        return entry["code"], entry["expires_at"]
+
+    def verify(self, key, code):
+        """Check code against the one issued for key; a valid or expired code is consumed"""
+        with self._lock:
+            result = _check(self._codes.get(key), code, datetime.utcnow())
+            if result in (VALID, EXPIRED):
+                del self._codes[key]
+            return result
+
+
+class MongoOTPStore:
+    """
+    OTP store shared by every worker process through the otps collection.
+    The expires_at TTL index (scripts/indexes.py) removes expired codes
+    """
+
+    def __init__(self, db=None):
+        if db is None:
+            from config.db import mongo
+            db = mongo.db
+        self._codes = db.otps
+
+    def issue(self, key, email, ttl_seconds):
+        now = datetime.utcnow()
+        code, expires_at = generate_code(), now + timedelta(seconds=ttl_seconds)
+        self._codes.replace_one(
+            {"_id": key},
+            {"_id": key, "code": code, "email": email, "created_at": now, "expires_at": expires_at},
+            upsert=True,
+        )
+        return code, expires_at
+
+    def verify(self, key, code):
+        entry = self._codes.find_one({"_id": key})
+        # The TTL monitor runs about once a minute, so expiry is checked here too
+        result = _check(entry, code, datetime.utcnow())
+        if result in (VALID, EXPIRED):
+            # Deleting by code as well makes a code usable once even across workers
+            deleted = self._codes.delete_one({"_id": key, "code": entry["code"]})
+            if result == VALID and deleted.deleted_count == 0:
+                return MISSING
+        return result
+
+
+def create_store(backend=OTP_BACKEND):
+    if backend == "mongo":
+        return MongoOTPStore()
+    if backend == "memory":
+        return MemoryOTPStore()
+    raise ValueError(f"Unknown OTP backend '{backend}'")
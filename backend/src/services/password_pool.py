@@ -0,0 +1,154 @@
+"""
+Process pool for password hashing and verification.
+
+scrypt is deliberately CPU-heavy. Running it in separate processes keeps login
+bursts from starving the I/O work of the server worker that received them.
+
+New hashes use scrypt with PASSWORD_SCRYPT_N/R/P. Verification reads the method
+stored in the hash itself, so hashes created with other parameters (or before
+this pool existed) keep verifying.
+"""
+import os
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import check_password_hash, generate_password_hash
+
+PASSWORD_SCRYPT_N = int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 15)))
+PASSWORD_SCRYPT_R = int(os.getenv("PASSWORD_SCRYPT_R", "8"))
+PASSWORD_SCRYPT_P = int(os.getenv("PASSWORD_SCRYPT_P", "1"))
+PASSWORD_HASH_METHOD = f"scrypt:{PASSWORD_SCRYPT_N}:{PASSWORD_SCRYPT_R}:{PASSWORD_SCRYPT_P}"
+
+# 0 workers hashes on the calling thread
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Hash jobs queued or running at once before new ones are rejected
+PASSWORD_POOL_MAX_PENDING = int(os.getenv("PASSWORD_POOL_MAX_PENDING", "64"))
+PASSWORD_POOL_TIMEOUT = float(os.getenv("PASSWORD_POOL_TIMEOUT", "10"))
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def _hash(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _verify(pwhash, password):
+    return check_password_hash(pwhash, password)
+
+
+_lock = threading.Lock()
+_pool = None
+_pool_pid = None
+_slots = threading.BoundedSemaphore(PASSWORD_POOL_MAX_PENDING)
+_stats = {"submitted": 0, "rejected": 0, "pending": 0, "max_pending": 0, "wait_ms_total": 0.0}
+
+
+def _get_pool():
+    # One pool per process; a pool inherited through fork is never reused
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Forking the threaded server process could copy locks held by other
+            # threads; pool processes are forked from a clean forkserver instead.
+            # Each pool process still re-runs the server's __main__ as __mp_main__,
+            # which is why app.py only starts its services outside of that
+            methods = multiprocessing.get_all_start_methods()
+            if "forkserver" in methods:
+                context = multiprocessing.get_context("forkserver")
+                context.set_forkserver_preload([__name__])
+            else:
+                context = multiprocessing.get_context("spawn")
+            _pool = ProcessPoolExecutor(max_workers=PASSWORD_POOL_WORKERS, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _lock:
+        _pool = None
+
+
+def _reset_after_fork():
+    # The child must not reuse the parent's pool or a lock held during fork
+    global _lock, _pool, _pool_pid, _slots
+    _lock = threading.Lock()
+    _pool = None
+    _pool_pid = None
+    _slots = threading.BoundedSemaphore(PASSWORD_POOL_MAX_PENDING)
+    _stats.update(submitted=0, rejected=0, pending=0, max_pending=0, wait_ms_total=0.0)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _run(func, *args):
+    if PASSWORD_POOL_WORKERS <= 0:
+        return func(*args)
+
+    if not _slots.acquire(blocking=False):
+        with _lock:
+            _stats["rejected"] += 1
+        raise PasswordPoolBusy("Too many password hashes in progress")
+
+    started = time.perf_counter()
+    with _lock:
+        _stats["submitted"] += 1
+        _stats["pending"] += 1
+        _stats["max_pending"] = max(_stats["max_pending"], _stats["pending"])
+
+    # The semaphore of this process, even if released after a fork reset
+    slots = _slots
+
+    def release(_=None):
+        with _lock:
+            _stats["pending"] -= 1
+        slots.release()
+
+    future = None
+    try:
+        try:
+            future = _get_pool().submit(func, *args)
+            return future.result(timeout=PASSWORD_POOL_TIMEOUT)
+        except BrokenProcessPool:
+            # A pool process died; start a fresh pool for the next request
+            _reset_pool()
+            future = None
+            return func(*args)
+    finally:
+        with _lock:
+            _stats["wait_ms_total"] += (time.perf_counter() - started) * 1000
+        # A hash still queued after a timeout is dropped; one already running keeps
+        # its slot until it finishes, so timeouts can't pile up work past the limit
+        if future is None or future.done() or future.cancel():
+            release()
+        else:
+            future.add_done_callback(release)
+
+
+def hash_password(password):
+    """
+    Hash a password in the pool with the configured scrypt parameters
+
+    Raises:
+        PasswordPoolBusy: If PASSWORD_POOL_MAX_PENDING hashes are already in progress
+    """
+    return _run(_hash, password, PASSWORD_HASH_METHOD)
+
+
+def check_password(pwhash, password):
+    """Verify a password against a stored hash of any supported method"""
+    return _run(_verify, pwhash, password)
+
+
+def stats():
+    with _lock:
+        result = dict(_stats, workers=PASSWORD_POOL_WORKERS, method=PASSWORD_HASH_METHOD)
+    completed = result["submitted"] - result["pending"]
+    result["avg_wait_ms"] = result["wait_ms_total"] / completed if completed else 0.0
+    return result